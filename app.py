@@ -1,24 +1,34 @@
 import warnings
 warnings.filterwarnings("ignore")
 import streamlit as st
-from streamlit_chat import message
-from dual_chat_bot import DualChatbot
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import os
 import time
-from gtts import gTTS
-from io import BytesIO
+import threading
+import weakref
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import TRACER, bind, set_session
+from llm_pool import load_env
+from lazy_import import lazy_import
+
+## the LLM / TTS stack is only imported once Generate, Translate or Play audio is first used,
+## so the sidebar is interactive right after a deploy or process restart (see lazy_import.py)
+streamlit_chat = lazy_import('streamlit_chat')
+dual_chat_bot = lazy_import('dual_chat_bot')
+text_to_speech = lazy_import('text_to_speech')
+speculative = lazy_import('speculative')
+lesson_store = lazy_import('lesson_store')
+vocab_index = lazy_import('vocab_index')
 
 ## streamlit chat library - sepcifcally designed for creating chatbot UI's
-## gtts : Google Text-to-Speech, to add audio to the bot-generated conversation script in the project
+## gtts : Google Text-to-Speech (see text_to_speech.py), to add audio to the bot-generated conversation script in the project
 ## user interface using streamlit
 
 ## define the language learning settings
 LANGUAGES = ['English', 'German', 'Spanish', 'French']
 SESSION_LENGHTS = ['Short', 'Long']
 PROFICIENCY_LEVELS = ['Beginner', 'Intermediate', 'Advanced']
-MAX_EXCHANGE_COUNTS = {
-    'Short' : {'Conversation' : 8, 'Debate' : 4},
-    'Long' : {'Conversation' : 16, 'Debate': 8}
-}
 
 AUDIO_SPEECH = {
     'English' : 'en',
@@ -30,21 +40,384 @@ AUDIO_SPEECH = {
 AVATAR_SEED = [123, 42]
 
 ## define backbone LLM
-engine = 'GroqCloud'
+## set LLM_ENGINE=Local to run the app offline against the fake model (see fake_llm.py)
+## settings may come from the .env file, it is read once per process
+load_env()
+engine = os.getenv('LLM_ENGINE', 'GroqCloud')
+
+## conversation memory strategy of the bots ('buffer', 'window', 'token_budget' or 'summary', see chat_memory.py)
+## bounded strategies keep per-turn latency flat in Long / Debate sessions
+MEMORY_STRATEGY = 'buffer'
+MEMORY_OPTIONS = {}
+
+## fold each exchange round into the learning-points summary in the background while later rounds generate
+INCREMENTAL_SUMMARY = True
+
+## translations and audio are computed lazily the first time the user asks for them
+## optionally, they can be prefetched in the background as soon as the script is complete
+PREFETCH_TRANSLATIONS = False
+PREFETCH_AUDIO = False
+
+## on first generation the replies are streamed token by token into the chat bubbles
+## instead of waiting for each full reply, messages are paced by reading speed
+STREAMING = True
+READING_WORDS_PER_SECOND = float(os.getenv('READING_WORDS_PER_SECOND', 3))
+
+## live audio: while the conversation is streamed, every reply is synthesized in the background as soon as
+## it is generated and played right after it is shown, the next message waits until the clip has been played
+LIVE_AUDIO = False
+
+## optionally, once a session is complete, the same scenario at the other proficiency levels is generated in the background
+## (within a token budget, see speculative.py), so switching the level and regenerating is served from cache
+SPECULATIVE_PREFETCH = False
+## also warm the same scenario in the other target languages
+SPECULATIVE_LANGUAGES = False
+
+## directory of saved lessons, they can be reopened without calling the LLM (see lesson_store.py)
+LESSON_DIR = os.getenv('LESSON_DIR', 'lessons')
+
+@st.cache_resource
+def speculative_prefetcher():
+    """
+    Speculative generator shared by all sessions, so the total speculative work of the process stays bounded
+    """
+    return speculative.SpeculativePrefetcher(engine)
+
+@st.cache_resource
+def prefetch_pool():
+    """
+    Worker pool shared by all sessions for background prefetching
+    """
+    return ThreadPoolExecutor(max_workers = 4, thread_name_prefix = "prefetch")
+
+@st.cache_data(max_entries = 4)
+def list_saved_lessons(directory, modified):
+    """
+    Saved lessons of directory, cached per modification time of the directory:
+    saving (or deleting) a lesson changes it, so the library is only read again after a change
+    """
+    return lesson_store.list_lessons(directory)
+
+def lesson_library():
+    """
+    Saved lessons of LESSON_DIR, newest first, as (path, meta) pairs
+    """
+    try:
+        modified = os.stat(LESSON_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    return list_saved_lessons(LESSON_DIR, modified)
+
+@st.cache_resource
+def vocabulary_index():
+    """
+    Vocabulary / grammar index shared by all sessions (see vocab_index.py).
+    Built from the saved lessons on first use, generated sessions are added utterance by utterance
+    """
+    index = vocab_index.VocabularyIndex(PROFICIENCY_LEVELS)
+    for path, meta in lesson_library():
+        index_saved_lesson(index, path)
+    return index
+
+def index_saved_lesson(index, path):
+    """
+    Adds a saved lesson to the index, keyed by its path
+    """
+    lesson = lesson_store.SavedLesson(path)
+    try:
+        index.add_lesson(path, lesson.settings, lesson.transcript, lesson_store.lesson_title(lesson.settings))
+    finally:
+        lesson.close()
+
+def synthesize_audio(text, language):
+    """
+    Creates the audio speech of a message in the target language.
+    Audio is cached by (text, language code), so repeat plays are served from memory or disk
+
+    Output:
+    audio bytes
+    """
+    return text_to_speech.get_synthesizer().synthesize(text, AUDIO_SPEECH[language])
+
+def ensure_translations(dual_chatbots, mesg_list):
+    """
+    Fills in the missing translations of the messages, memoized per message in session state.
+    Uses the background prefetch if there is one, otherwise translates all missing messages in a single request
+    """
+    prefetch = st.session_state.pop('translation_prefetch', None)
+    if prefetch is not None:
+        for mesg, translation in zip(mesg_list, prefetch.result()):
+            mesg.translation = translation
+
+    untranslated = [mesg for mesg in mesg_list if mesg.translation is None]
+    if untranslated:
+        translations = dual_chatbots.translate_batch([mesg.content for mesg in untranslated])
+        for mesg, translation in zip(untranslated, translations):
+            mesg.translation = translation
+
+def ensure_audio(mesg_list, language):
+    """
+    Fills in the missing audio speech of the messages, memoized per message in session state.
+    Uses the background prefetch if there is one
+    """
+    prefetch = st.session_state.pop('audio_prefetch', None)
+    if prefetch is not None:
+        for mesg, sound in zip(mesg_list, prefetch):
+            mesg.audio = sound.result()
+
+    ## all missing utterances are synthesized concurrently
+    missing = [mesg for mesg in mesg_list if mesg.audio is None]
+    sounds = text_to_speech.get_synthesizer().synthesize_many([mesg.content for mesg in missing], AUDIO_SPEECH[language])
+    for mesg, sound in zip(missing, sounds):
+        mesg.audio = sound
+
+def start_prefetch(dual_chatbots, mesg_list):
+    """
+    Starts computing translations / audio of a complete script in the background, if enabled
+    """
+    if PREFETCH_TRANSLATIONS:
+        st.session_state['translation_prefetch'] = prefetch_pool().submit(
+            bind(dual_chatbots.translate_batch), [mesg.content for mesg in mesg_list])
+    if PREFETCH_AUDIO:
+        st.session_state['audio_prefetch'] = [text_to_speech.get_synthesizer().submit(mesg.content, AUDIO_SPEECH[dual_chatbots.language])
+                                              for mesg in mesg_list]
+
+def save_current_lesson(dual_chatbots, summary):
+    """
+    Saves the complete lesson - translations and audio are computed first if they were not requested yet
+
+    Output:
+    path of the saved lesson
+    """
+    spec = st.session_state['session_spec']
+    mesg_list = list(dual_chatbots.transcript)
+    ensure_translations(dual_chatbots, mesg_list)
+    ensure_audio(mesg_list, dual_chatbots.language)
+    os.makedirs(LESSON_DIR, exist_ok = True)
+    path = os.path.join(LESSON_DIR, lesson_store.lesson_filename(spec))
+    lesson_store.save_lesson(path, spec, dual_chatbots.transcript, summary, text_to_speech.get_synthesizer().format)
+    ## from now on the lesson is known to the vocabulary index by its path
+    if 'lesson_key' in st.session_state:
+        vocabulary_index().rename(st.session_state['lesson_key'], path)
+        st.session_state['lesson_key'] = path
+    return path
+
+def session_header(spec):
+    """
+    Header of the generated / loaded session, it describes the session's settings, not the current sidebar settings
+    """
+    if spec['learning_mode'] == 'Conversation':
+        return f"""### {spec['role_dict']['role1']['name']} and {spec['role_dict']['role2']['name']} {spec['scenario']} 🎭"""
+    return f"""### Debate 💬: {spec['scenario']}"""
+
+def load_lesson(path):
+    """
+    Opens a saved lesson as the current session, no LLM is involved
+    """
+    lesson = lesson_store.SavedLesson(path)
+    st.session_state['dual_chatbots'] = lesson
+    st.session_state['session_spec'] = lesson.settings
+    st.session_state['summary'] = lesson.summary
+    st.session_state['saved_path'] = path
+    st.session_state['first_time_exec'] = False
+    ## lessons saved after the index was built are indexed when they are opened
+    st.session_state['lesson_key'] = path
+    index = vocabulary_index()
+    if path not in index.sessions:
+        index.add_lesson(path, lesson.settings, lesson.transcript, lesson_store.lesson_title(lesson.settings))
+
+def current_session_id():
+    """
+    Id of the Streamlit session of the current script run (None outside of Streamlit).
+    The run context is not kept in a global of the script: it references the script runner and its thread,
+    and Streamlit's hashing keeps per-thread state that refers back to the script's functions and globals,
+    which would keep a closed session's chatbots (and their vocabulary index entries) alive
+    """
+    session_ctx = get_script_run_ctx()
+    return session_ctx.session_id if session_ctx else None
+
+def background_stream(chunks, stop):
+    """
+    Starts consuming a chunk generator in a background thread right away, so generation keeps running
+    while the caller is still pacing / displaying earlier messages.
+    Once the `stop` event is set (e.g. the script run was stopped by a rerun) the generator is closed
+    at its next chunk, a reply that was cut off is not recorded.
+    Returns a generator over the chunks produced so far and to come
+    """
+    queue = Queue()
+    def pump():
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                queue.put(chunk)
+        except Exception as exc:
+            queue.put(exc)
+        finally:
+            chunks.close()
+        queue.put(None)
+    ## started here, not on the first next() of the returned generator
+    threading.Thread(target = bind(pump), daemon = True).start()
+
+    def received():
+        while (chunk := queue.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    return received()
+
+def reading_time(text):
+    """
+    Time a learner needs to read a message, used to pace the streamed conversation
+    """
+    return len(text.split()) / READING_WORDS_PER_SECOND
+
+def mark_timing(milestone):
+    """
+    Records when the current session first reached a latency milestone ('first_message', 'summary'),
+    relative to the Generate click (see show_performance and loadtest.py)
+    """
+    timings = st.session_state.get('timings')
+    if timings is not None and milestone not in timings:
+        timings[milestone] = time.monotonic() - timings['requested']
+
+def message_key(position, view):
+    """
+    Stable key of a chat bubble: the message's position in the transcript and what it shows ('original' / 'translation').
+    A message keeps its keys across reruns, so the frontend updates its bubbles in place instead of re-mounting
+    every component of the transcript, and the keys don't grow with the number of reruns
+    """
+    return f"{position}-{view}"
+
+def stream_exchange(dual_chatbots, not_before, live_audio = None):
+    """
+    Generates and displays one exchange round while streaming each reply into its chat bubble.
+    The next reply starts generating as soon as the previous one is complete, but is only shown
+    once the learner had time to read the previous message (`not_before`, a time.monotonic() deadline)
+    With live_audio (a text_to_speech.LiveAudio subscribed to the chatbots) every reply is played once shown,
+    and the next one also waits for the end of the clip
+
+    Output:
+    mesg_1, mesg_2: generated messages
+    not_before: deadline for showing the next message
+    """
+    ## resumed in the middle of a round, its first reply is already shown
+    roles = ['role1', 'role2'] if dual_chatbots.next_role == 'role1' else ['role2']
+    ## the background streams end with this function, also when Streamlit stops the run in the middle of it
+    stop = threading.Event()
+    try:
+        ## the reply is generated in the background while the learner is still reading the previous one
+        chunks = background_stream(dual_chatbots.stream_turn(roles[0]), stop)
+        for role in roles:
+            i = 0 if role == 'role1' else 1
+            position = len(dual_chatbots.transcript)
+            time.sleep(max(0, not_before - time.monotonic()))
+
+            placeholder = st.empty()
+            text = ""
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                text += chunk
+                mark_timing('first_message')
+                ## every partial text is a new element of the placeholder and needs its own key
+                with placeholder:
+                    streamlit_chat.message(text, is_user=i==1, avatar_style="bottts", seed = AVATAR_SEED[i], key = message_key(position, f"stream-{len(text)}"))
+            with placeholder:
+                streamlit_chat.message(text, is_user=i==1, avatar_style="bottts", seed = AVATAR_SEED[i], key = message_key(position, 'original'))
+            not_before = time.monotonic() + reading_time(text)
+            ## the reply is recorded, the other bot starts answering before the pacing / audio waits
+            if role == 'role1' and len(roles) == 2:
+                chunks = background_stream(dual_chatbots.stream_turn('role2'), stop)
+
+            if live_audio is not None:
+                ## the clip was started in the background when the reply was recorded
+                sound, duration = live_audio.next_clip()
+                ## the alt text keeps identical clips apart, st.audio elements are identified by their parameters
+                st.audio(sound, format = live_audio.synthesizer.format, autoplay = True, alt = f"Audio of message {position + 1}")
+                not_before = max(not_before, time.monotonic() + duration)
+
+        ## the completed replies were recorded in the shared transcript
+        mesg_1, mesg_2 = dual_chatbots.transcript[-2:]
+        return mesg_1, mesg_2, not_before
+    finally:
+        stop.set()
+
+def generate_conversation(dual_chatbots, time_delay, language):
+    """
+    Lets the bots talk until they close the scene or use up the exchange budget, showing every exchange as it is generated.
+    Every reply is recorded in the session's transcript the moment it is complete, so if a call fails for good
+    the messages shown so far are kept and 'Resume generation' continues from the last recorded turn
+
+    Output:
+    True if the conversation is complete, False if generation stopped on an error
+    """
+    live_audio = None
+    try:
+        if STREAMING:
+            if LIVE_AUDIO:
+                live_audio = text_to_speech.LiveAudio(text_to_speech.get_synthesizer(), AUDIO_SPEECH[language])
+                dual_chatbots.subscribe(live_audio.add)
+            not_before = time.monotonic()
+            while not dual_chatbots.finished:
+                mesg_1, mesg_2, not_before = stream_exchange(dual_chatbots, not_before, live_audio)
+        else:
+            for _ in dual_chatbots.exchanges(translate = False):
+                ## the exchange round was recorded in the shared transcript
+                mesg_1, mesg_2 = dual_chatbots.transcript[-2:]
+
+                mark_timing('first_message')
+                show_messages(mesg_1, mesg_2, len(dual_chatbots.transcript) - 2,
+                              time_delay = time_delay, language=language, batch = False,
+                              audio = False, translation = False)
+    except Exception as exc:
+        st.error(f"Generation stopped after {len(dual_chatbots.transcript)} messages ({exc}). "
+                 "Use 'Resume generation' to continue from the last message.")
+        return False
+    finally:
+        if live_audio is not None:
+            dual_chatbots.subscribers.remove(live_audio.add)
+    return True
+
+def show_performance(session_id):
+    """
+    Sidebar panel with per-stage latency, token and cache statistics of the current session,
+    plus JSON / Prometheus exports of the recorded calls
+    """
+    timings = st.session_state.get('timings', {})
+    if 'first_message' in timings:
+        st.sidebar.caption(f"First message after {timings['first_message']:.2f} s"
+                           + (f", summary after {timings['summary']:.2f} s" if 'summary' in timings else ""))
+    stats = TRACER.stage_stats(session_id)
+    if not stats:
+        st.sidebar.caption("No LLM or TTS calls recorded yet")
+        return
+    st.sidebar.dataframe([
+        {'stage' : stage, 'calls' : s['calls'], 'total s' : round(s['latency'], 2),
+         'avg s' : round(s['latency'] / s['calls'], 2), 'prompt tok' : s['prompt_tokens'],
+         'cache hits' : s['cache_hits'], 'errors' : s['errors']}
+        for stage, s in sorted(stats.items(), key = lambda item: -item[1]['latency'])
+    ], hide_index = True)
+    st.sidebar.download_button("Export JSON", TRACER.export_json(session_id, include_spans = True),
+                               file_name = "session_trace.json", mime = "application/json")
+    st.sidebar.download_button("Export Prometheus", TRACER.export_prometheus(),
+                               file_name = "metrics.prom", mime = "text/plain")
 
 ## helper fucntion
-def show_messages(mesg_1, mesg_2, message_counter, time_delay, language, batch = False, audio = False, translation = False):
+def show_messages(mesg_1, mesg_2, position, time_delay, language, batch = False, audio = False, translation = False,
+                  audio_format = None):
     """
     Display conversation exchanges, This helper function supports displaying original texts, translated texts and audio speech.
-    
-    Output: 
-    message_counter: updated counter for ID key
+    `position` is the transcript position of mesg_1, it keys the chat bubbles (see message_key)
+    `audio_format` is the MIME type of the messages' audio, by default the one of the current synthesizer
+    `mesg_2` is None for a round that stopped after its first reply
     """
     
     for i, mesg in enumerate([mesg_1, mesg_2]):
+        if mesg is None:
+            continue
         ## show original exchange
-        message(f"{mesg['content']}", is_user=i==1, avatar_style="bottts", seed = AVATAR_SEED[i], key = str(message_counter))
-        message_counter +=1
+        streamlit_chat.message(f"{mesg.content}", is_user=i==1, avatar_style="bottts", seed = AVATAR_SEED[i], key = message_key(position + i, 'original'))
 
         ## mimic time interval between conversations
         ## (this time delay appears when generating the conversation script for the first time)
@@ -53,19 +426,74 @@ def show_messages(mesg_1, mesg_2, message_counter, time_delay, language, batch =
         ## show translated message
         if translation:
             ## is user defines message should be left / right alighed
-            message(f"{mesg['translation']}", is_user=i==1, avatar_style="bottts", seed=AVATAR_SEED[i], key = str(message_counter))
-            message_counter +=1
+            streamlit_chat.message(f"{mesg.translation}", is_user=i==1, avatar_style="bottts", seed=AVATAR_SEED[i], key = message_key(position + i, 'translation'))
 
         ## append the audio to the exchange
         if audio:
-            ## gtts library to create audio speech in the target language based on the generated script.
-            ## Library has a limitation - t can have only one voice
-            tts = gTTS(text = mesg['content'], lang=AUDIO_SPEECH[language])
-            sound_file = BytesIO()
-            tts.write_to_fp(sound_file)
-            st.audio(sound_file)
-        
-    return message_counter
+            ## audio is synthesized once per message, see ensure_audio
+            if mesg.audio is None:
+                mesg.audio = synthesize_audio(mesg.content, language)
+            st.audio(mesg.audio, format = audio_format or text_to_speech.get_synthesizer().format, alt = f"Audio of message {position + i + 1}")
+
+@st.fragment
+def transcript_view(dual_chatbots, header, time_delay, live_rendered = False):
+    """
+    Shows the generated conversation with the Translate / Show original / Play audio buttons.
+    Runs as a fragment: clicking one of the buttons only reruns this view, not the sidebar and the summary.
+    `live_rendered` is True in the run that generated the conversation, it was then already streamed
+    into the conversation container outside this view
+    """
+    ## fragment reruns run on their own thread, the Translate / Play audio calls are attributed to the session here
+    set_session(current_session_id())
+
+    view_container = st.container()
+    translate_col, original_col, audio_col = st.columns(3)
+
+    clicked = False
+    # show translation
+    if translate_col.button('Translate to English'):
+        st.session_state['translate_flag'] = True
+        clicked = True
+    # show original text
+    if original_col.button('Show original'):
+        st.session_state['translate_flag'] = False
+        clicked = True
+    # Append audio
+    if audio_col.button('Play audio'):
+        st.session_state['audio_flag'] = True
+        clicked = True
+
+    if live_rendered:
+        if clicked:
+            ## the streamed conversation is drawn outside the fragment, a full rerun replaces it with this view
+            st.rerun()
+        return
+
+    ## translations / audio are only computed the first time they are shown
+    mesg_list = list(dual_chatbots.transcript)
+    if st.session_state['translate_flag']:
+        ensure_translations(dual_chatbots, mesg_list)
+    audio_format = None
+    if st.session_state['audio_flag']:
+        ## a saved lesson brings its own audio, in the format of the synthesizer it was saved with
+        if isinstance(dual_chatbots, lesson_store.SavedLesson):
+            dual_chatbots.fill_audio()
+            audio_format = dual_chatbots.audio_format
+        ensure_audio(mesg_list, dual_chatbots.language)
+
+    # show complete message
+    with view_container:
+        st.write(header)
+        ## an incomplete generation can end in the middle of a round
+        for position in range(0, len(mesg_list), 2):
+            show_messages(mesg_list[position], mesg_list[position + 1] if position + 1 < len(mesg_list) else None, position,
+                          time_delay = time_delay,
+                          language = dual_chatbots.language,
+                          batch = True,
+                          audio = st.session_state['audio_flag'],
+                          translation = st.session_state['translate_flag'],
+                          audio_format = audio_format
+                          )
 
 
 ## basic ui layout with options for user to select
@@ -112,34 +540,45 @@ proficiency_level = st.sidebar.selectbox('Proficiency Level 🏆', PROFICIENCY_L
 ## here time_delay is used for specifying the waiting time btw displaying two consecutive messages
 ## beneficial for user to allow enough time to read the generatred messages before the next exhange appears
 
+## every LLM / TTS call of this script run is attributed to the Streamlit session
+session_id = current_session_id()
+set_session(session_id)
+## only the run that generates draws the conversation live (Generate / Resume set the flag again),
+## a run that Streamlit stopped in the middle of a generation left it set
+st.session_state['first_time_exec'] = False
+
 # Add reset button to clear session state
 if st.sidebar.button("🔄 Reset Session"):
+    ## a saved lesson keeps its file open (memory-mapped) until it is closed
+    if 'dual_chatbots' in st.session_state and isinstance(st.session_state['dual_chatbots'], lesson_store.SavedLesson):
+        st.session_state['dual_chatbots'].close()
+    ## a generated session that wasn't saved leaves the vocabulary index with it
+    if 'lesson_key' in st.session_state and 'saved_path' not in st.session_state:
+        vocabulary_index().remove(st.session_state['lesson_key'])
     for key in list(st.session_state.keys()):
         del st.session_state[key]
+    TRACER.drop_session(session_id)
     st.rerun()
 
+# optional instrumentation panel
+if st.sidebar.checkbox("Show performance 📊"):
+    show_performance(session_id)
+
 
-# Define containers and columns
+# Define containers
+## the conversation container shows the conversation while it is generated,
+## afterwards it is shown by transcript_view together with its buttons
 conversation_container = st.container()
-translate_col, original_col, audio_col = st.columns(3)
 
 ## streamlit session state to store user-specific session data in the streamlit app
-if "bot1_mesg" not in st.session_state:
-    st.session_state["bot1_mesg"] = []
-    ## this is a list whose elements are a dictionary that holds the message spoekn by first chatbot
-    ## keys - role, content, translation
-
-if "bot2_mesg" not in st.session_state:
-    st.session_state["bot2_mesg"] = []
-    ## same as bot1_msg
-
-if 'batch_flag' not in st.session_state:
-    st.session_state["batch_flag"] = False
-    ## indicates whether the conversation messages are shown all at once or with a time delay
-    ## the chat between the bots will appear with a time delay when thier conversations are generated for the first time
-    ## when user wants to see the translation/add audio for the generated conv, the stored conversation messages "bot1_mesg" "bot2_mesg" can be shown at once
-    ## this is benefecial since we dont need to call api again , reduces cost and latency
+## the generated messages are not copied into session state,
+## they are read from the shared transcript of the dual chatbots (mesg1_list / mesg2_list below)
+## every message is a transcript.Utterance - role, content, translation, audio
+## translation and audio stay None until they are first requested
 
+## the chat between the bots appears with a time delay when thier conversations are generated for the first time
+## when user wants to see the translation/add audio for the generated conv, the stored conversation messages are shown at once
+## this is benefecial since we dont need to call api again , reduces cost and latency
 
 if 'translate_flag' not in st.session_state:
     st.session_state['translate_flag'] = False
@@ -149,16 +588,39 @@ if 'audio_flag' not in st.session_state:
     st.session_state["audio_flag"] = False
     ## indicates if its a audio
 
-if 'message_counter' not in st.session_state:
-    st.session_state["message_counter"] = 0
-    ## adds one whenever a message from chatbot is displayed
-    ## also to add message ID with this counter as streamlit requires that each UI components to have a unique ID                      
+## streamlit requires every UI component to have a unique ID,
+## chat bubbles are keyed by their transcript position and view (see message_key)
 
 ## streamlit reruns / reload the scripts on every user interaction
 ## regular python variables would lose thier values, and the app would reset to its initial state
 ## "session_state" in streamlit provides a way to store and retrieve data that persists throughout the user's session
 ## even if the app is reloaded or the user navigates between different components or pages
 
+## reopen a saved lesson instead of generating a new one
+if 'dual_chatbots' not in st.session_state:
+    saved_lessons = lesson_library()
+    if saved_lessons:
+        choice = st.sidebar.selectbox('Saved lessons 📂', range(len(saved_lessons)),
+                                      format_func = lambda i: lesson_store.lesson_title(saved_lessons[i][1]['settings']))
+        if st.sidebar.button('Load saved lesson'):
+            load_lesson(saved_lessons[choice][0])
+
+## look up the saved lessons and the current session that use a word,
+## sessions other users are generating stay private to them
+word_query = st.sidebar.text_input('Find lessons using a word 🔎')
+if word_query:
+    index = vocabulary_index()
+    visible = {path for path, meta in lesson_library()}
+    if 'lesson_key' in st.session_state:
+        visible.add(st.session_state['lesson_key'])
+    hits = index.lessons_with(word_query, sessions = visible)
+    if not hits:
+        st.sidebar.caption(f"No lesson uses '{word_query}' yet.")
+    for lesson_key, word_language, positions in hits[:10]:
+        levels = index.difficulty(word_query, word_language)['counts']
+        st.sidebar.caption(f"{index.sessions[lesson_key]['title']}: {len(positions)}x "
+                           f"({', '.join(f'{level} {count}' for level, count in levels.items() if count)})")
+
 ##Letting chatbots interact and generate conversations
 if 'dual_chatbots' not in st.session_state:
 
@@ -170,6 +632,7 @@ if 'dual_chatbots' not in st.session_state:
         else:
             ## add flag to indicate first time script running
             st.session_state["first_time_exec"] = True
+            st.session_state['timings'] = {'requested' : time.monotonic()}
 
             with conversation_container:
                 if learning_mode == 'Conversation':
@@ -179,28 +642,62 @@ if 'dual_chatbots' not in st.session_state:
                 else:
                     st.write(f"""### Debate 💬 : {scenario}""")
                 
+                ## the settings of the session, kept before DualChatbot adds the bots to role_dict
+                session_spec = {
+                    'role_dict' : {k: dict(v) for k, v in role_dict.items()},
+                    'language' : language,
+                    'scenario' : scenario,
+                    'proficiency_level' : proficiency_level,
+                    'learning_mode' : learning_mode,
+                    'session_length' : session_length,
+                    'memory_strategy' : MEMORY_STRATEGY,
+                    'memory_options' : MEMORY_OPTIONS,
+                    'incremental_summary' : INCREMENTAL_SUMMARY,
+                }
+                st.session_state['session_spec'] = session_spec
+                ## the new session takes priority over warming variants of the previous one
+                ## rounds that were already warmed stay in the cache
+                speculative_prefetcher().cancel(session_id)
+
                 ## Instantiate dual chatbot system
-                dual_chatbots = DualChatbot(engine, role_dict, language, scenario, proficiency_level, learning_mode, session_length)
+                dual_chatbots = dual_chat_bot.DualChatbot(engine, role_dict, language, scenario, proficiency_level, learning_mode, session_length,
+                                            memory_strategy = MEMORY_STRATEGY, memory_options = MEMORY_OPTIONS,
+                                            incremental_summary = INCREMENTAL_SUMMARY)
                 st.session_state['dual_chatbots'] = dual_chatbots
+                ## every recorded utterance is added to the vocabulary index right away
+                st.session_state['lesson_key'] = f"{session_id}-{time.time_ns()}"
+                index = vocabulary_index()
+                dual_chatbots.subscribe(index.indexer(st.session_state['lesson_key'], session_spec,
+                                                      lesson_store.lesson_title(session_spec)))
+                ## a session that ends without a Reset (e.g. the tab is closed) leaves the index with its chatbots,
+                ## a saved lesson was renamed to its path by then and stays
+                weakref.finalize(dual_chatbots, index.remove, st.session_state['lesson_key'])
 
                 ## start exchanges
-                for _ in range(MAX_EXCHANGE_COUNTS[session_length][learning_mode]):
-                    output1, output2, translate1, translate2 = dual_chatbots.step()
-
-                    mesg_1 = {"role" : dual_chatbots.chatbots['role1']['name'],
-                            "content" : output1, "translation" : translate1}
-                    mesg_2 = {"role" : dual_chatbots.chatbots['role2']['name'],
-                            "content" : output2, "translation" : translate2}
-                    
-                    new_count = show_messages(mesg_1, mesg_2, 
-                                            st.session_state["message_counter"],
-                                            time_delay = time_delay, language=language, batch = False,
-                                            audio = False, translation = False)
-                    st.session_state["message_counter"] = new_count
-
-                    ## update session state
-                    st.session_state.bot1_mesg.append(mesg_1)
-                    st.session_state.bot2_mesg.append(mesg_2)
+                ## the bots talk until they close the scene or use up the exchange budget of the session length
+                ## translations are not requested here, they are computed in one batch request
+                ## only once the user asks for them (see 'Translate to English' below)
+                ## a run stopped by a rerun (any widget change) never returns, the conversation stays incomplete
+                st.session_state['generation_complete'] = False
+                st.session_state['generation_complete'] = generate_conversation(dual_chatbots, time_delay, language)
+                if st.session_state['generation_complete']:
+                    start_prefetch(dual_chatbots, list(dual_chatbots.transcript))
+
+## a generation that stopped on an error (e.g. the LLM provider kept timing out) continues from its last recorded turn
+if 'dual_chatbots' in st.session_state and not st.session_state.get('generation_complete', True):
+    if st.sidebar.button('Resume generation ▶️'):
+        st.session_state["first_time_exec"] = True
+        dual_chatbots = st.session_state['dual_chatbots']
+        with conversation_container:
+            st.write(session_header(st.session_state['session_spec']))
+            ## the messages generated before the error are shown again, then the conversation continues below them
+            for position, mesg in enumerate(dual_chatbots.transcript):
+                streamlit_chat.message(mesg.content, is_user=position % 2 == 1, avatar_style="bottts",
+                                       seed = AVATAR_SEED[position % 2], key = message_key(position, 'original'))
+            st.session_state['generation_complete'] = False
+            st.session_state['generation_complete'] = generate_conversation(dual_chatbots, time_delay, language)
+            if st.session_state['generation_complete']:
+                start_prefetch(dual_chatbots, list(dual_chatbots.transcript))
 
 ## upon running the script for first time , the two chatbots will chat back and forth given number of times and all messages get stored in session state
 ## show_message is a helper function designed to be the sole interface to style the message display
@@ -210,59 +707,51 @@ if 'dual_chatbots' not in st.session_state:
 
 if 'dual_chatbots' in st.session_state:
 
-    # show translation
-    if translate_col.button('Translate to English'):
-        st.session_state['translate_flag'] = True
-        st.session_state['batch_flag'] = True
-    # show original text
-    if original_col.button('Show original'):
-        st.session_state['translate_flag'] = False
-        st.session_state['batch_flag'] = True
-    # Append audio
-    if audio_col.button('Play audio'):
-        st.session_state['audio_flag'] = True
-        st.session_state['batch_flag'] = True
-
     # retrieve generated conversation & chatbots
-    mesg1_list = st.session_state.bot1_mesg
-    mesg2_list = st.session_state.bot2_mesg
     dual_chatbots = st.session_state['dual_chatbots']
+    mesg1_list = dual_chatbots.transcript.by_speaker('role1')
+    mesg2_list = dual_chatbots.transcript.by_speaker('role2')
 
     # control message appearance
-    if st.session_state['first_time_exec']:
-        st.session_state['first_time_exec'] = False
-    else:
-        # show complete message
-        with conversation_container:
-            if learning_mode == 'Conversation':
-                st.write(f"""### {role1} and {role2} {scenario} 🎭""")
-            else:
-                st.write(f"""### Debate 💬: {scenario}""")
-
-            for mesg_1, mesg_2 in zip(mesg1_list, mesg2_list):
-                new_count = show_messages(mesg_1, mesg_2,
-                                          st.session_state["message_counter"],
-                                          time_delay = time_delay,
-                                          language=language,
-                                          batch = st.session_state['batch_flag'],
-                                          audio = st.session_state['audio_flag'],
-                                          translation = st.session_state['translate_flag']
-                                          )
-                st.session_state["message_counter"] = new_count
+    ## the header describes the session that was generated / loaded, not the current sidebar settings
+    header = session_header(st.session_state['session_spec'])
+    transcript_view(dual_chatbots, header, time_delay, live_rendered = st.session_state['first_time_exec'])
+    st.session_state['first_time_exec'] = False
+
+if 'dual_chatbots' in st.session_state and not st.session_state.get('generation_complete', True):
+    ## the summary and the saved lesson wait for the complete conversation
+    st.info("The conversation is incomplete, resume the generation to get the learning summary.")
+
+elif 'dual_chatbots' in st.session_state:
 
     ## Summary of key learning points in Ui
     summary_expander = st.expander('Key Learning Points')
     scripts = []
     for mesg_1, mesg_2 in zip(mesg1_list, mesg2_list):
         for i , mesg in enumerate([mesg_1, mesg_2]):
-            scripts.append(mesg['role'] + ': ' + mesg['content'])
+            scripts.append(mesg.role + ': ' + mesg.content)
 
     ## compile summary
     if "summary" not in st.session_state:
-        summary = dual_chatbots.summary(scripts)
+        summary = dual_chatbots.finish_summary(scripts)
         st.session_state["summary"] = summary
+        mark_timing('summary')
+        ## the session is complete, warm the variants the user is likely to try next
+        if SPECULATIVE_PREFETCH and 'session_spec' in st.session_state:
+            speculative_prefetcher().start(session_id, speculative.likely_variants(st.session_state['session_spec'], PROFICIENCY_LEVELS,
+                                                                        LANGUAGES if SPECULATIVE_LANGUAGES else ()))
     else:
         summary = st.session_state["summary"]
     with summary_expander:
         st.markdown(f"**Here is the learning summary: **")
-        st.write(summary)
\ No newline at end of file
+        st.write(summary)
+        ## vocabulary and grammar of the transcript from the local index, no LLM call involved
+        if 'lesson_key' in st.session_state:
+            st.markdown(vocabulary_index().vocabulary_markdown(st.session_state['lesson_key']))
+
+    ## save the complete lesson, so it can be reopened later without the LLM
+    if 'saved_path' in st.session_state:
+        st.sidebar.caption(f"Lesson saved to {st.session_state['saved_path']}")
+    elif st.sidebar.button('Save lesson 💾'):
+        st.session_state['saved_path'] = save_current_lesson(dual_chatbots, summary)
+        st.sidebar.caption(f"Lesson saved to {st.session_state['saved_path']}")
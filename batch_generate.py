@@ -0,0 +1,268 @@
+## headless batch generator for pre-building lesson libraries
+## reads scenario specs from a JSONL or CSV file, generates many sessions concurrently
+## and streams the results (script, translations, summary) to JSONL or Parquet.
+## Already generated specs are skipped, so an interrupted or partly failed run can simply be restarted.
+## With --checkpoint-dir every utterance is checkpointed, a restarted spec resumes from its last good turn.
+##
+## usage:
+##   python batch_generate.py specs.jsonl lessons.jsonl --workers 8 --sessions-per-minute 30
+##
+## every spec has the fields
+##   id (optional), learning_mode, scenario, language, proficiency_level, session_length,
+##   role1, action1, role2, action2 (conversation mode only)
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dual_chat_bot import DualChatbot
+from checkpoint import Checkpoint
+from scheduler import BATCH, priority_scope
+from instrumentation import session_scope
+
+DEFAULT_ENGINE = "GroqCloud"
+## rows buffered before a Parquet part file is written
+PARQUET_ROWS_PER_PART = 100
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that at most `per_minute` of them start every minute
+    """
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(max(0, start - now))
+
+
+def read_specs(path):
+    """
+    Reads scenario specs from a .jsonl or .csv file.
+    Specs without an id get one derived from their content, so reruns recognise them
+    """
+    with open(path, newline = "", encoding = "utf-8") as f:
+        if path.endswith(".csv"):
+            specs = [dict(row) for row in csv.DictReader(f)]
+        else:
+            specs = [json.loads(line) for line in f if line.strip()]
+
+    for spec in specs:
+        if not spec.get("id"):
+            payload = json.dumps(spec, sort_keys = True, ensure_ascii = False)
+            spec["id"] = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+    return specs
+
+
+def build_role_dict(spec):
+    """
+    Role dictionary expected by DualChatbot, same as the one built by the app's sidebar
+    """
+    if spec["learning_mode"] == "Conversation":
+        return {
+            'role1' : {'name': spec["role1"], 'action' : spec["action1"]},
+            'role2' : {'name': spec["role2"], 'action' : spec["action2"]}
+        }
+    return {
+        'role1' : {'name' : 'Proponent'},
+        'role2' : {'name' : 'Opponent'}
+    }
+
+
+def generate_session(spec, engine = DEFAULT_ENGINE, checkpoint_dir = None):
+    """
+    Generates one complete lesson: the script, its English translation and the learning summary.
+    With checkpoint_dir the script is checkpointed after every utterance and a failed spec resumes from its checkpoint
+
+    Output:
+    dict with the spec id, the spec itself, the script as a list of {role, content, translation} and the summary
+    """
+    dual_chatbots = DualChatbot(engine, build_role_dict(spec), spec["language"], spec["scenario"],
+                                spec["proficiency_level"], spec["learning_mode"], spec["session_length"])
+    checkpoint = None
+    if checkpoint_dir:
+        checkpoint = Checkpoint(os.path.join(checkpoint_dir, spec["id"] + ".jsonl"))
+        done = checkpoint.load()[1] if checkpoint.exists() else []
+        ## the checkpoint is rewritten while the finished turns are replayed
+        checkpoint.start(spec)
+        dual_chatbots.subscribe(checkpoint.record)
+        dual_chatbots.restore(done)
+
+    ## runs up to the exchange budget of the session length, stops early once the bots close the scene
+    for _ in dual_chatbots.exchanges(translate = False):
+        pass
+
+    utterances = list(dual_chatbots.transcript)
+    translations = dual_chatbots.translate_batch([u.content for u in utterances])
+    summary = dual_chatbots.summary([u.role + ': ' + u.content for u in utterances])
+    if checkpoint is not None:
+        checkpoint.discard()
+
+    return {
+        "id" : spec["id"],
+        "spec" : spec,
+        "script" : [{"role" : u.role, "content" : u.content, "translation" : translation}
+                    for u, translation in zip(utterances, translations)],
+        "summary" : summary,
+    }
+
+
+class JsonlSink:
+    """
+    Appends one JSON line per lesson
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def done_ids(self):
+        if not os.path.exists(self.path):
+            return set()
+        ids = set()
+        with open(self.path, encoding = "utf-8") as f:
+            for line in f:
+                try:
+                    ids.add(json.loads(line)["id"])
+                except ValueError:
+                    ## a line cut off when the process was killed mid-write, its lesson is generated again
+                    continue
+        return ids
+
+    def __enter__(self):
+        self._file = open(self.path, "a", encoding = "utf-8")
+        ## a truncated last line must not swallow the first new lesson
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write("\n")
+        return self
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def write(self, result):
+        self._file.write(json.dumps(result, ensure_ascii = False) + "\n")
+        self._file.flush()
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+class ParquetSink:
+    """
+    Writes lessons as Parquet part files into a directory (requires pyarrow)
+    """
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow, please install it or use a .jsonl output")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        self._rows = []
+
+    def done_ids(self):
+        ids = set()
+        for part in glob.glob(os.path.join(self.path, "part-*.parquet")):
+            ids.update(self.pq.read_table(part, columns = ["id"]).column("id").to_pylist())
+        return ids
+
+    def __enter__(self):
+        return self
+
+    def write(self, result):
+        self._rows.append({
+            "id" : result["id"],
+            "spec" : json.dumps(result["spec"], ensure_ascii = False),
+            "script" : json.dumps(result["script"], ensure_ascii = False),
+            "summary" : result["summary"],
+        })
+        if len(self._rows) >= PARQUET_ROWS_PER_PART:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        part = os.path.join(self.path, f"part-{time.time_ns()}.parquet")
+        self.pq.write_table(self.pa.Table.from_pylist(self._rows), part)
+        self._rows = []
+
+    def __exit__(self, *exc):
+        self._flush()
+
+
+def make_sink(path):
+    """
+    Parquet for *.parquet paths (written as a directory of part files), JSONL otherwise
+    """
+    if path.endswith(".parquet"):
+        return ParquetSink(path)
+    return JsonlSink(path)
+
+
+def run(specs, sink, workers = 4, sessions_per_minute = None, engine = DEFAULT_ENGINE, checkpoint_dir = None):
+    """
+    Generates all specs that are not in the sink yet, `workers` sessions at a time
+
+    Output:
+    (number of generated lessons, number of failed specs)
+    """
+    done = sink.done_ids()
+    todo = [spec for spec in specs if spec["id"] not in done]
+    print(f"{len(done)} lessons already generated, {len(todo)} to go", file = sys.stderr)
+
+    limiter = RateLimiter(sessions_per_minute)
+    def task(spec):
+        limiter.wait()
+        ## batch lessons yield to interactive sessions in the shared LLM scheduler
+        with priority_scope(BATCH), session_scope("batch-" + spec["id"]):
+            return generate_session(spec, engine, checkpoint_dir)
+
+    generated, failed = 0, 0
+    with sink, ThreadPoolExecutor(max_workers = workers) as pool:
+        futures = {pool.submit(task, spec): spec for spec in todo}
+        for future in as_completed(futures):
+            spec = futures[future]
+            try:
+                sink.write(future.result())
+                generated += 1
+            except Exception:
+                ## failed specs are not written and get retried on the next run
+                failed += 1
+                print(f"spec {spec['id']} failed:\n{traceback.format_exc()}", file = sys.stderr)
+    return generated, failed
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Pre-generate language learning lessons in batch")
+    parser.add_argument("specs", help = "scenario specs, .jsonl or .csv")
+    parser.add_argument("output", help = "output .jsonl file, or .parquet directory")
+    parser.add_argument("--workers", type = int, default = 4, help = "sessions generated concurrently")
+    parser.add_argument("--sessions-per-minute", type = float, default = None, help = "limit on started sessions per minute")
+    parser.add_argument("--engine", default = DEFAULT_ENGINE, help = "backbone LLM engine")
+    parser.add_argument("--checkpoint-dir", help = "checkpoint every utterance here, failed specs resume on the next run")
+    args = parser.parse_args(argv)
+
+    generated, failed = run(read_specs(args.specs), make_sink(args.output),
+                            workers = args.workers, sessions_per_minute = args.sessions_per_minute, engine = args.engine,
+                            checkpoint_dir = args.checkpoint_dir)
+    print(f"generated {generated} lessons, {failed} failed", file = sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
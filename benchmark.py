@@ -0,0 +1,205 @@
+## end-to-end latency benchmark of a complete session, run offline against the local fake LLM
+## reports, for Short/Long x Conversation/Debate sessions:
+## - end-to-end session time and its breakdown into generate / translate / summarize / tts
+## - prompt tokens sent per turn
+## - how many LLM clients / chains had to be constructed
+## with --startup it instead measures the app's cold start: time until the first script run has rendered
+## the sidebar in a fresh process, and which heavy modules that run loaded
+##
+## usage:
+##   python benchmark.py                       # all four session types, fake LLM with default latency
+##   python benchmark.py --latency 0.2 --tokens-per-second 100 --json bench.json
+##   python benchmark.py --startup 5           # cold start of app.py, 5 fresh processes
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+warnings.filterwarnings("ignore")
+
+SESSION_LENGTHS = ['Short', 'Long']
+LEARNING_MODES = ['Conversation', 'Debate']
+ROLE_DICTS = {
+    'Conversation' : {
+        'role1' : {'name': 'Customer', 'action' : 'ordering a coffee'},
+        'role2' : {'name': 'Waiter', 'action' : 'taking the order'}
+    },
+    'Debate' : {
+        'role1' : {'name' : 'Proponent'},
+        'role2' : {'name' : 'Opponent'}
+    }
+}
+SCENARIOS = {'Conversation' : 'in a cafe', 'Debate' : 'Should homework be abolished?'}
+
+## modules that should not be loaded before the user asks for a script
+HEAVY_MODULES = ['langchain', 'langchain_core', 'langchain_groq', 'gtts', 'streamlit_chat']
+
+## run in a fresh interpreter: imports streamlit, runs app.py once without clicking anything and reruns it
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+app = AppTest.from_file({app!r}, default_timeout = 60)
+app.run()
+first_run = time.perf_counter()
+app.run()
+rerun = time.perf_counter() - first_run
+print(json.dumps({{
+    'streamlit_import' : imported - start,
+    'first_run' : first_run - imported,
+    'rerun' : rerun,
+    'heavy_modules' : [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def run_session(session_length, learning_mode, language = 'German', proficiency_level = 'Intermediate',
+                engine = 'Local', memory_strategy = 'buffer', tts_backend = 'tone'):
+    """
+    Runs one complete session the way the app does and times every stage
+
+    Output:
+    dict with per-stage seconds, prompt tokens per turn and client construction counts
+    """
+    import llm_pool
+    from dual_chat_bot import DualChatbot
+    from text_to_speech import SpeechSynthesizer, TTS_BACKENDS
+
+    llm_pool.reset_pool()
+    ## a fresh synthesizer, so no clip is served from a previous session's memory cache
+    synthesizer = SpeechSynthesizer(TTS_BACKENDS[tts_backend]())
+    role_dict = {k: dict(v) for k, v in ROLE_DICTS[learning_mode].items()}
+    stages = {}
+
+    start = time.perf_counter()
+    dual_chatbots = DualChatbot(engine, role_dict, language, SCENARIOS[learning_mode], proficiency_level,
+                                learning_mode, session_length, memory_strategy = memory_strategy)
+    stages['setup'] = time.perf_counter() - start
+
+    mark = time.perf_counter()
+    for _ in dual_chatbots.exchanges(translate = False):
+        pass
+    stages['generate'] = time.perf_counter() - mark
+
+    utterances = list(dual_chatbots.transcript)
+    mark = time.perf_counter()
+    dual_chatbots.translate_batch([u.content for u in utterances])
+    stages['translate'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    dual_chatbots.summary([u.role + ': ' + u.content for u in utterances])
+    stages['summarize'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    synthesizer.synthesize_many([u.content for u in utterances], 'de')
+    stages['tts'] = time.perf_counter() - mark
+
+    total = time.perf_counter() - start
+    prompt_tokens = [tokens for per_role in dual_chatbots.prompt_tokens().values() for tokens in per_role]
+    return {
+        'session' : f"{session_length}/{learning_mode}",
+        'utterances' : len(utterances),
+        'total' : total,
+        'stages' : stages,
+        'prompt_tokens_per_turn' : {
+            'mean' : sum(prompt_tokens) / len(prompt_tokens),
+            'max' : max(prompt_tokens),
+            'last' : prompt_tokens[-1],
+        },
+        'pool' : llm_pool.pool_stats(),
+    }
+
+
+def format_report(results):
+    """
+    Renders benchmark results as a plain text table
+    """
+    header = f"{'session':<20}{'total':>8}{'generate':>10}{'translate':>11}{'summarize':>11}{'tts':>8}" \
+             f"{'tok/turn':>10}{'tok max':>9}{'clients':>9}{'chains':>8}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        s = r['stages']
+        lines.append(f"{r['session']:<20}{r['total']:>8.2f}{s['generate']:>10.2f}{s['translate']:>11.2f}"
+                     f"{s['summarize']:>11.2f}{s['tts']:>8.2f}{r['prompt_tokens_per_turn']['mean']:>10.0f}"
+                     f"{r['prompt_tokens_per_turn']['max']:>9}{r['pool']['client_builds']:>9}{r['pool']['chain_builds']:>8}")
+    return "\n".join(lines)
+
+
+def startup_benchmark(repeats = 3, app_path = None):
+    """
+    Measures the cold start of the app in `repeats` fresh processes
+
+    Output:
+    dict with the median seconds of the streamlit import, the first script run (sidebar rendered)
+    and a rerun, plus the heavy modules the first run loaded
+    """
+    app_path = app_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    script = STARTUP_SCRIPT.format(app = app_path, heavy = HEAVY_MODULES)
+    env = dict(os.environ, LLM_ENGINE = "Local", PYTHONWARNINGS = "ignore")
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", script], cwd = os.path.dirname(app_path), env = env,
+                                capture_output = True, text = True, check = True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'runs' : repeats,
+        'streamlit_import' : statistics.median(r['streamlit_import'] for r in runs),
+        'first_run' : statistics.median(r['first_run'] for r in runs),
+        'rerun' : statistics.median(r['rerun'] for r in runs),
+        'heavy_modules' : runs[-1]['heavy_modules'],
+    }
+
+
+def format_startup_report(result):
+    """
+    Renders the startup benchmark as plain text
+    """
+    return "\n".join([
+        f"cold start of app.py, median of {result['runs']} fresh processes",
+        f"  streamlit import   {result['streamlit_import']:.3f} s",
+        f"  first script run   {result['first_run']:.3f} s",
+        f"  rerun              {result['rerun']:.3f} s",
+        f"  heavy modules loaded: {', '.join(result['heavy_modules']) or 'none'}",
+    ])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Offline end-to-end session latency benchmark")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "fake LLM seconds to first token")
+    parser.add_argument("--tokens-per-second", type = float, default = 500, help = "fake LLM throughput")
+    parser.add_argument("--completion-tokens", type = int, default = 40, help = "fake LLM tokens per reply")
+    parser.add_argument("--memory", default = "buffer", help = "conversation memory strategy")
+    parser.add_argument("--cache", action = "store_true", help = "keep the persistent LLM cache enabled")
+    parser.add_argument("--json", help = "also write the results to this file")
+    parser.add_argument("--startup", type = int, metavar = "N", help = "measure the app's cold start in N fresh processes instead")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        result = startup_benchmark(args.startup)
+        print(format_startup_report(result))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent = 2)
+        return 0
+
+    os.environ["FAKE_LLM_LATENCY"] = str(args.latency)
+    os.environ["FAKE_LLM_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["FAKE_LLM_COMPLETION_TOKENS"] = str(args.completion_tokens)
+    if not args.cache:
+        os.environ["LLM_CACHE_DISABLED"] = "1"
+
+    results = [run_session(length, mode, memory_strategy = args.memory)
+               for length in SESSION_LENGTHS for mode in LEARNING_MODES]
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent = 2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
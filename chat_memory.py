@@ -0,0 +1,164 @@
+## conversation memory strategies for Chatbot
+## an unbounded buffer resends the whole history on every turn, so the prompt grows with every exchange.
+## The bounded strategies keep the prompt size (and therefore per-turn latency) flat in long sessions:
+##
+## - buffer       : full history (the original behaviour)
+## - window       : only the last `max_turns` exchanges
+## - token_budget : the most recent messages that fit into `max_tokens`
+## - summary      : a rolling summary of older turns plus the last `max_turns` exchanges verbatim
+from langchain.prompts import PromptTemplate
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from llm_cache import cached_call
+from instrumentation import estimate_tokens
+
+
+def count_message_tokens(messages):
+    """
+    Estimated number of tokens of a list of chat messages, including a small per-message overhead
+    """
+    return sum(estimate_tokens(m.content) + 4 for m in messages)
+
+
+class MessageLog:
+    """
+    Private message history of a standalone chatbot.
+    A DualChatbot uses a shared transcript.TranscriptView instead
+    """
+    def __init__(self):
+        self._messages = []
+
+    def add_turn(self, input, output):
+        self._messages.append(HumanMessage(content = input))
+        self._messages.append(AIMessage(content = output))
+
+    def messages(self):
+        return self._messages
+
+    def clear(self):
+        self._messages = []
+
+
+class BufferMemory:
+    """
+    Keeps the full conversation history
+    """
+    def __init__(self, source = None):
+        ## source provides messages() and add_turn(input, output)
+        self.source = source if source is not None else MessageLog()
+
+    def add_turn(self, input, output):
+        """
+        Records one turn: what the chatbot was told and what it replied
+        """
+        self.source.add_turn(input, output)
+
+    def history(self):
+        """
+        Messages that are sent as history with the next prompt
+        """
+        return list(self.source.messages())
+
+
+class WindowMemory(BufferMemory):
+    """
+    Keeps only the last `max_turns` turns of the conversation
+    """
+    def __init__(self, source = None, max_turns = 6):
+        super().__init__(source)
+        self.max_turns = max_turns
+
+    def history(self):
+        return self.source.messages()[-2 * self.max_turns:]
+
+
+class TokenBudgetMemory(BufferMemory):
+    """
+    Keeps the most recent messages whose estimated size fits into `max_tokens`
+    """
+    def __init__(self, source = None, max_tokens = 1500):
+        super().__init__(source)
+        self.max_tokens = max_tokens
+
+    def history(self):
+        messages = self.source.messages()
+        budget = self.max_tokens
+        start = len(messages)
+        while start > 0:
+            cost = count_message_tokens(messages[start - 1:start])
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 1
+        return messages[start:]
+
+
+SUMMARY_MEMORY_PROMPT = PromptTemplate(
+    input_variables = ["summary", "new_lines"],
+    template = """
+        Progressively summarize the lines of conversation provided, adding onto the previous summary
+        and returning a new summary. Keep the summary short and in the language of the conversation.
+
+        Current summary:
+        {summary}
+
+        New lines of conversation:
+        {new_lines}
+
+        New summary:
+        """
+)
+
+
+class SummaryMemory(BufferMemory):
+    """
+    Keeps the last `max_turns` turns verbatim and folds older turns into a rolling summary,
+    which is sent as a system message in front of the recent history
+    """
+    def __init__(self, llm, source = None, max_turns = 4):
+        super().__init__(source)
+        self.llm = llm
+        self.max_turns = max_turns
+        self.summary = ""
+        ## number of leading messages already folded into the summary
+        self._folded = 0
+
+    def _fold(self, messages):
+        """
+        Merges older messages into the rolling summary
+        """
+        new_lines = "\n".join(f"{m.type}: {m.content}" for m in messages)
+        prompt = SUMMARY_MEMORY_PROMPT.format(summary = self.summary, new_lines = new_lines)
+        self.summary = cached_call(self.llm, prompt, lambda: self.llm.invoke(prompt).content, stage = "memory_summary").strip()
+
+    def history(self):
+        messages = self.source.messages()
+        overflow = len(messages) - self._folded - 2 * self.max_turns
+        if overflow > 0:
+            self._fold(messages[self._folded:self._folded + overflow])
+            self._folded += overflow
+
+        recent = list(messages[self._folded:])
+        if not self.summary:
+            return recent
+        return [SystemMessage(content = "Summary of the earlier conversation: " + self.summary)] + recent
+
+
+MEMORY_STRATEGIES = {
+    'buffer' : BufferMemory,
+    'window' : WindowMemory,
+    'token_budget' : TokenBudgetMemory,
+    'summary' : SummaryMemory,
+}
+
+
+def make_memory(strategy, llm, source = None, **options):
+    """
+    Instantiates a memory strategy by name, options are passed to the strategy
+    (e.g. max_turns for 'window' / 'summary', max_tokens for 'token_budget').
+    source is where the history is read from, a private MessageLog if None
+    """
+    if strategy not in MEMORY_STRATEGIES:
+        raise KeyError("Currently unsupported memory strategy!")
+    if strategy == 'summary':
+        return SummaryMemory(llm, source, **options)
+    return MEMORY_STRATEGIES[strategy](source, **options)
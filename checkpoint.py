@@ -0,0 +1,68 @@
+## checkpoints of sessions in progress
+## every utterance is appended to a small JSON lines file the moment it is recorded, so a session that failed
+## (a stalled call, a crash, a restarted process) can resume from its last good turn instead of starting over.
+##
+## file layout: the first line holds the session spec, every further line one utterance
+## {"speaker": "role1", "role": "Waiter", "content": "..."}
+import json
+import os
+import threading
+
+
+class Checkpoint:
+    """
+    Append-only checkpoint of one session, subscribe record() to a DualChatbot to keep it up to date
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def start(self, spec):
+        """
+        Starts a fresh checkpoint for a session with the given spec
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        with self._lock, open(self.path, "w", encoding = "utf-8") as f:
+            f.write(json.dumps(spec, ensure_ascii = False) + "\n")
+
+    def record(self, utterance):
+        """
+        Appends one utterance, flushed to disk right away
+        """
+        line = json.dumps({"speaker" : utterance.speaker, "role" : utterance.role, "content" : utterance.content},
+                          ensure_ascii = False)
+        with self._lock, open(self.path, "a", encoding = "utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self):
+        """
+        Reads the checkpoint back. A last line cut off by a crash is ignored
+
+        Outputs:
+        ------------
+        (spec, list of utterance dicts)
+        """
+        with open(self.path, encoding = "utf-8") as f:
+            lines = f.read().split("\n")
+        spec = json.loads(lines[0])
+        utterances = []
+        for line in lines[1:]:
+            try:
+                utterances.append(json.loads(line))
+            except ValueError:
+                break
+        return spec, utterances
+
+    def discard(self):
+        """
+        Removes the checkpoint once the session is complete
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
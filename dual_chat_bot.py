@@ -1,16 +1,91 @@
 from single_chat_bot import Chatbot
+from prompt_catalog import exchange_count
 from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langchain_groq import ChatGroq
-import os
-from dotenv import load_dotenv
+from llm_pool import get_chain
+from llm_cache import cached_predict
+from transcript import Transcript
+from instrumentation import bind
+from summarizer import IncrementalSummarizer
+from concurrent.futures import ThreadPoolExecutor
+import re
 import warnings
 warnings.filterwarnings("ignore")
 
-load_dotenv()
-api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY environment variable not set. Please set the API key.")
+## translations don't depend on the next dialogue turn, so they are handed to a shared worker pool
+## and run while the following exchange is being generated
+TRANSLATION_WORKERS = 4
+_translation_pool = ThreadPoolExecutor(max_workers = TRANSLATION_WORKERS, thread_name_prefix = "translate")
+
+
+## prompt templates are compiled once and shared by every DualChatbot instance
+TRANSLATION_PROMPT = PromptTemplate(
+    input_variables = ["src_lang", "trg_lang", "src_input"],
+    template = """
+            Translate the following sentence from {src_lang} (source language)
+            to {trg_lang} (target language).
+            Here is the sentence in source language: \n
+            {src_input}.
+            """
+)
+
+## batch translation sends many numbered utterances in one request
+## the reply is expected to keep the same numbering so it can be split back per message
+BATCH_TRANSLATION_PROMPT = PromptTemplate(
+    input_variables = ["src_lang", "trg_lang", "count", "src_input"],
+    template = """
+            Translate each of the following {count} numbered sentences from {src_lang} (source language)
+            to {trg_lang} (target language).
+            Reply with exactly {count} lines, one per sentence, in the same order.
+            Every line must start with the sentence number in square brackets, e.g. [1], followed by the translation only.
+            Here are the sentences in source language: \n
+            {src_input}
+            """
+)
+
+## matches the "[n]" marker that starts every translated sentence in a batch reply
+_BATCH_MARKER = re.compile(r"^\s*\[(\d+)\]\s*", re.MULTILINE)
+
+SUMMARY_PROMPT = PromptTemplate(
+    input_variables = ["src_lang", "proficiency", "script"],
+    template = """
+        The following text is a simulated conversation in {src_lang}.
+        The goal of this text  is to aid {src_lang} learners to learn real-life
+        usage of {src_lang}. Therefore , your task is to summarize the key learning
+        points based on the given text. Specifically, you should summarize the key vocabulary,
+        grammar points and function phrases that could be important for students learning {src_lang}.
+        Your summary should be conducted in English , but use examples from the text in the original language where appropriate.
+        Remember your target students have proficiency level of  {proficiency} in {src_lang}. Your 
+        summarization must match thier proficiency level.
+
+        The conversation is :\n
+        {script}
+        """
+)
+
+## phrases that mark the natural end of a scene: farewells in conversation mode, concluding remarks in debate mode
+## matched case-insensitively on the lower-cased utterance
+CLOSING_PHRASES = {
+    'English' : ["goodbye", "good bye", "bye", "see you", "take care", "have a nice day", "have a great day",
+                 "in conclusion", "to sum up", "to conclude", "in summary"],
+    'German' : ["auf wiedersehen", "tschüss", "tschüs", "bis bald", "bis später", "schönen tag",
+                "abschließend", "zusammenfassend", "zum schluss"],
+    'Spanish' : ["adiós", "adios", "hasta luego", "hasta pronto", "nos vemos", "que tengas un buen día",
+                 "en conclusión", "para concluir", "en resumen"],
+    'French' : ["au revoir", "à bientôt", "a bientôt", "bonne journée", "à plus tard",
+                "en conclusion", "pour conclure", "en résumé"],
+}
+
+## a scene is never closed before this many exchange rounds, bots tend to greet with "see you" style phrases
+MIN_EXCHANGES = 2
+
+
+def closing_markers(text, language):
+    """
+    Closing phrases of `language` found in text
+    """
+    text = text.lower()
+    return [phrase for phrase in CLOSING_PHRASES.get(language, CLOSING_PHRASES['English'])
+            if re.search(r"(?<!\w)" + re.escape(phrase) + r"(?!\w)", text)]
 
 
 ## A Dual Chat Bot class to let two chatbots interact with each ohter
@@ -19,16 +94,25 @@ class DualChatbot:
     Class definition for dual-chatbots interaction system,
     created with Langchain
     """
+
+    ## instruction the first bot receives to open the conversation
+    OPENER = "Start the conversation"
     
-    def __init__(self, engine, role_dict, language, scenario, proficiency_level, learning_mode, session_length):
+    def __init__(self, engine, role_dict, language, scenario, proficiency_level, learning_mode, session_length,
+                 memory_strategy = "buffer", memory_options = None, incremental_summary = False,
+                 exchange_budget = None, closure_classifier = None):
         ## Instantiate two chatbots
         self.engine = engine
         self.proficiency_level = proficiency_level
         self.language = language
         self.chatbots = role_dict
+        ## both bots read their history from one shared transcript, each through a role-swapped view
+        self.transcript = Transcript()
         ## self.chatbots is a dict designed to store info related to both bots
+        ## memory_strategy / memory_options bound how much history each bot resends per turn, see chat_memory.py
         for k in role_dict.keys():
-            self.chatbots[k].update({'chatbot': Chatbot(engine)})
+            view = self.transcript.view(k, opener = self.OPENER if k == 'role1' else None)
+            self.chatbots[k].update({'chatbot': Chatbot(engine, memory_strategy, memory_options, history_source = view)})
 
         ## assigning roles for two chatbots
         self.chatbots['role1']['chatbot'].instruct(
@@ -54,6 +138,17 @@ class DualChatbot:
 
         ## add session length
         self.session_length = session_length
+
+        ## at most `exchange_budget` rounds are generated, fewer if the bots close the scene earlier
+        self.exchange_budget = exchange_budget or exchange_count(session_length, learning_mode)
+        ## optional closure_classifier(script_lines) -> bool, only consulted when the phrase heuristic fires
+        self.closure_classifier = closure_classifier
+
+        ## optionally fold every exchange round into the learning-points summary while the next rounds generate
+        self.summarizer = IncrementalSummarizer(engine, language, proficiency_level) if incremental_summary else None
+
+        ## callbacks receiving every new utterance the moment it is recorded, see subscribe()
+        self.subscribers = []
         
         ## prepare conversation
         self._reset_conversation_history()
@@ -63,75 +158,201 @@ class DualChatbot:
         serves to initiate a fresh conversation history and provide initial info to chatbots
         """
         # placeholder for conversation history
-        self.conversation_history = []
+        self.transcript.utterances.clear()
 
         ## inputs for two chatbots
-        self.input1 = "Start the conversation"
+        self.input1 = self.OPENER
         self.input2 = ""
+
+        ## set once the bots have wrapped up the scene
+        self.closed = False
+
+    @property
+    def conversation_history(self):
+        """
+        The conversation so far as a list of {"bot": role name, "text": utterance}
+        """
+        return [{"bot" : u.role, "text" : u.content} for u in self.transcript]
+
+    def subscribe(self, callback):
+        """
+        Calls callback(utterance) for every utterance recorded from now on, in the generating thread,
+        e.g. to start synthesizing its audio while the next turn is generated
+        """
+        self.subscribers.append(callback)
+
+    def _record(self, role, output):
+        """
+        Appends an utterance to the shared transcript and passes it as input to the other chatbot
+        """
+        utterance = self.transcript.append(role, self.chatbots[role]['name'], output)
+        for callback in self.subscribers:
+            callback(utterance)
+        if role == 'role1':
+            self.input2 = output
+        else:
+            self.input1 = output
+            ## the exchange round is complete
+            if self.summarizer is not None:
+                self.summarizer.add_round([u.role + ': ' + u.content for u in self.transcript[-2:]])
+            self.closed = self._detect_closure()
+        return utterance
+
+    @property
+    def rounds(self):
+        """
+        Number of completed exchange rounds
+        """
+        return len(self.transcript) // 2
+
+    @property
+    def finished(self):
+        """
+        True once the scene is closed or the exchange budget is used up
+        """
+        return self.closed or self.rounds >= self.exchange_budget
+
+    def _detect_closure(self):
+        """
+        Decides after a completed round whether the bots have ended the scene.
+        Without a classifier both utterances of the round must contain a closing phrase,
+        with a classifier one phrase is enough to ask it and its verdict decides
+        """
+        if self.rounds < MIN_EXCHANGES:
+            return False
+        last_round = self.transcript[-2:]
+        hits = [bool(closing_markers(u.content, self.language)) for u in last_round]
+        if self.closure_classifier is None:
+            return all(hits)
+        if not any(hits):
+            return False
+        return bool(self.closure_classifier([u.role + ': ' + u.content for u in self.transcript]))
     
-    def step(self):
+    def prompt_tokens(self):
         """
-        Facilitates interaction between the two bots, 
-        Makes one exchange round between two chatbots
+        Estimated prompt tokens sent per turn by each bot
+
+        Outputs:
+        ------------
+        dict mapping role name to the list of per-turn prompt token counts
         """
+        return {self.chatbots[k]['name']: list(self.chatbots[k]['chatbot'].prompt_tokens) for k in ('role1', 'role2')}
 
-        ## chatbot1 speaks
-        output1 = self.chatbots['role1']['chatbot'].conversation.predict(input = self.input1)
-        self.conversation_history.append({"bot":self.chatbots['role1']['name'], "text" : output1})
+    @property
+    def next_role(self):
+        """
+        The bot that speaks next, 'role2' if a resumed session stopped in the middle of a round
+        """
+        return 'role1' if len(self.transcript) % 2 == 0 else 'role2'
+
+    def restore(self, utterances):
+        """
+        Replays the utterances of a checkpoint (dicts with speaker and content), so the session continues
+        from its last good turn. Subscribers see the replayed utterances like new ones
+        """
+        for u in utterances:
+            ## the bot remembers the turn as if it had just generated it
+            input = self.input1 if u['speaker'] == 'role1' else self.input2
+            self.chatbots[u['speaker']]['chatbot'].memory.add_turn(input, u['content'])
+            self._record(u['speaker'], u['content'])
+
+    def _generate_exchange(self):
+        """
+        Makes one exchange round between two chatbots and returns both raw outputs
+        """
 
-        ## pass output of chatbot1 as input to chatbot2
-        self.input2 = output1
+        ## chatbot1 speaks
+        ## its output is passed as input to chatbot2
+        if self.next_role == 'role1':
+            output1 = self.chatbots['role1']['chatbot'].predict(input = self.input1)
+            self._record('role1', output1)
+        else:
+            ## resumed in the middle of a round, chatbot1 already spoke
+            output1 = self.transcript[-1].content
 
         ## chatbot2 speaks
-        output2 = self.chatbots['role2']['chatbot'].conversation.predict(input = self.input2)
-        self.conversation_history.append({"bot" : self.chatbots['role2']['name'], "text": output2})
+        ## its output is passed as input to chatbot1
+        output2 = self.chatbots['role2']['chatbot'].predict(input = self.input2)
+        self._record('role2', output2)
+
+        return output1, output2
 
-        ## pass output of chatbot2 as input to chatbot1
-        self.input1 = output2
+    def stream_turn(self, role):
+        """
+        Lets one bot ('role1' or 'role2') speak, yielding its reply chunk by chunk as it is generated.
+        Calling stream_turn('role1') then stream_turn('role2') makes one exchange round,
+        equivalent to _generate_exchange()
+        """
+        chunks = []
+        for chunk in self.chatbots[role]['chatbot'].stream(self.input1 if role == 'role1' else self.input2):
+            chunks.append(chunk)
+            yield chunk
+        self._record(role, "".join(chunks))
+
+    def _submit_translations(self, output1, output2):
+        """
+        Hands the translation of one exchange round to the shared worker pool
+        Returns a future for each translation
+        """
+        return (_translation_pool.submit(bind(self.translate), output1),
+                _translation_pool.submit(bind(self.translate), output2))
+
+    def step(self, translate = True):
+        """
+        Facilitates interaction between the two bots, 
+        Makes one exchange round between two chatbots
+        With translate = False the translations are skipped and returned as None,
+        so they can be computed lazily with translate() / translate_batch() when needed
+        """
+        output1, output2 = self._generate_exchange()
+        if not translate:
+            return output1, output2, None, None
 
         # translate responses
         ## translate method translate the script to English
         ## helps users understand the meaning of conversation in target language
-        translate1 = self.translate(output1)
-        translate2 = self.translate(output2)
+        ## both translations of the round run concurrently
+        future1, future2 = self._submit_translations(output1, output2)
+
+        return output1, output2, future1.result(), future2.result()
+
+    def exchanges(self, num_exchanges = None, translate = True):
+        """
+        Pipelined version of step() that runs up to `num_exchanges` rounds (by default the rest of the exchange budget,
+        a resumed session continues where it stopped) and stops early once the bots close the scene.
+        The translations of round N run in the background while round N+1 is generated,
+        so the dialogue never waits on the translator.
+
+        Yields (output1, output2, translate1, translate2) in order, where translate1/translate2
+        are futures; call .result() on them once the translation is needed.
+        With translate = False no translation is requested and translate1/translate2 are None,
+        translate_batch() can then translate the whole script on demand.
+        """
+        if num_exchanges is None:
+            num_exchanges = 0 if self.closed else self.exchange_budget - self.rounds
+        for _ in range(num_exchanges):
+            output1, output2 = self._generate_exchange()
+            if translate:
+                future1, future2 = self._submit_translations(output1, output2)
+            else:
+                future1, future2 = None, None
+            yield output1, output2, future1, future2
+            if self.closed:
+                break
 
-        return output1, output2, translate1, translate2
-    
     def translate(self, message):
         """
         We employ the basic LLMChain which requires a backend LLM model and a prompt for instruction.
+        The chain is shared process-wide, see llm_pool.get_chain.
         This will then translate the generated script to English
         """
         if self.language == 'English':
             ## no translation performed
             translation = 'Translation : ' + message
         else:
-            ## intantiate translator
-            if self.engine == "GroqCloud":
-                self.translator = ChatGroq(
-                temperature = 0,
-                api_key = api_key,
-                model = "llama-3.3-70b-versatile"
-                )
-            else:
-                raise KeyError("Currently unsupported translation model type!")
-            
-            ## specify instruction
-            instruction = """
-            Translate the following sentence from {src_lang} (source language)
-            to {trg_lang} (target language).
-            Here is the sentence in source language: \n
-            {src_input}.
-            """
-
-            prompt = PromptTemplate(
-                input_variables = ["src_lang", "trg_lang", "src_input"],
-                template = instruction
-            )
-
-            ## creare a language translation chain
-            translator_chain = LLMChain(llm = self.translator, prompt = prompt)
-            translation = translator_chain.predict(
+            ## retrieve the shared language translation chain
+            translator_chain = get_chain(self.engine, "translation", TRANSLATION_PROMPT)
+            translation = cached_predict(translator_chain, "translate",
                 src_lang = self.language,
                 trg_lang = "English",
                 src_input = message
@@ -139,49 +360,83 @@ class DualChatbot:
             
         return translation
     
-    def summary(self, script):
+    def translate_batch(self, messages):
         """
-        Creates a summary of the key language learning points of the generated conversation script.
-        Key vocabulary, grammar points, function phrases.
-        This summary is created based on the user's proficiency level
+        Translates many messages (an exchange round or the whole script) to English in a single request.
+        The messages are sent as one numbered list and the reply is split back per message.
+        If the reply can't be split into exactly one translation per message,
+        every message is translated on its own with translate() instead.
+
+        Outputs:
+        ------------
+        translations : list of translations, aligned with messages
         """
+        messages = list(messages)
+        if not messages:
+            return []
+        if self.language == 'English':
+            ## no translation performed
+            return ['Translation : ' + message for message in messages]
 
-        ## instantiate a summary bot
-        if self.engine == "GroqCloud":
-            self.summary_bot = ChatGroq(
-                temperature = 0,
-                api_key = api_key,
-                model = "llama-3.3-70b-versatile"
-                )
-        else:
-            raise KeyError("Currently unsupported summary model type!")
-        
-        ## specify instruction
-        instruction = """
-        The following text is a simulated conversation in {src_lang}.
-        The goal of this text  is to aid {src_lang} learners to learn real-life
-        usage of {src_lang}. Therefore , your task is to summarize the key learning
-        points based on the given text. Specifically, you should summarize the key vocabulary,
-        grammar points and function phrases that could be important for students learning {src_lang}.
-        Your summary should be conducted in English , but use examples from the text in the original language where appropriate.
-        Remember your target students have proficiency level of  {proficiency} in {src_lang}. Your 
-        summarization must match thier proficiency level.
+        translator_chain = get_chain(self.engine, "batch_translation", BATCH_TRANSLATION_PROMPT)
+        reply = cached_predict(translator_chain, "translate_batch",
+            src_lang = self.language,
+            trg_lang = "English",
+            count = len(messages),
+            src_input = "\n".join(f"[{i}] {' '.join(message.split())}" for i, message in enumerate(messages, start = 1))
+            )
 
-        The conversation is :\n
-        {script}
+        translations = self._split_batch_reply(reply, len(messages))
+        if translations is None:
+            ## fall back to one request per message, run concurrently
+            futures = [_translation_pool.submit(bind(self.translate), message) for message in messages]
+            translations = [future.result() for future in futures]
+        return translations
+
+    @staticmethod
+    def _split_batch_reply(reply, count):
         """
+        Splits a batch translation reply into its numbered parts.
+        Returns None if the numbering doesn't match 1..count exactly
+        """
+        markers = list(_BATCH_MARKER.finditer(reply))
+        if [int(marker.group(1)) for marker in markers] != list(range(1, count + 1)):
+            return None
 
-        prompt = PromptTemplate(
-            input_variables = ["src_lang", "proficiency", "script"],
-            template=instruction
-        )
+        translations = []
+        for marker, next_marker in zip(markers, markers[1:] + [None]):
+            end = next_marker.start() if next_marker else len(reply)
+            translations.append(reply[marker.end():end].strip())
+        if not all(translations):
+            return None
+        return translations
+
+    def summary(self, script):
+        """
+        Creates a summary of the key language learning points of the generated conversation script.
+        Key vocabulary, grammar points, function phrases.
+        This summary is created based on the user's proficiency level
+        """
 
-        ## create a language summary chain
-        summary_chain = LLMChain(llm = self.summary_bot, prompt = prompt)
-        summary = summary_chain.predict(
+        ## retrieve the shared language summary chain
+        summary_chain = get_chain(self.engine, "summary", SUMMARY_PROMPT)
+        summary = cached_predict(summary_chain, "summarize",
             src_lang = self.language,
             proficiency = self.proficiency_level,
             script = script
         )
 
-        return summary
\ No newline at end of file
+        return summary
+
+    def finish_summary(self, script):
+        """
+        Returns the learning-points summary of the session.
+        With incremental_summary the rounds were already folded in the background and only a short merge call is left,
+        otherwise (or if the incremental summary failed) the whole script is summarized with summary()
+        """
+        if self.summarizer is not None:
+            try:
+                return self.summarizer.finish()
+            except Exception:
+                pass
+        return self.summary(script)
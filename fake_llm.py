@@ -0,0 +1,99 @@
+## deterministic local stand-in for a chat LLM, registered in llm_pool as engine "Local"
+## it needs no network or API key and simulates latency (time to first token), throughput (tokens per second)
+## and reply length, so sessions can be benchmarked and regression-tested offline
+import hashlib
+import os
+import random
+import re
+import time
+from typing import Any, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+## the words the fake model speaks
+_VOCABULARY = (
+    "hallo bonjour hola danke merci gracias bitte café tee wasser brot kaffee "
+    "heute morgen gestern gut schön grand petit bueno malo ja nein oui non sí"
+).split()
+## numbered lines of a batch translation request, see DualChatbot.translate_batch
+_NUMBERED_LINE = re.compile(r"^\s*\[(\d+)\]", re.MULTILINE)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model returning deterministic pseudo text derived from the prompt.
+    Batch translation prompts (numbered lines) are answered with the same numbering
+    """
+    model_name: str = "fake-local"
+    temperature: float = 0
+    ## seconds until the first token
+    latency: float = 0.05
+    ## tokens generated per second after the first token, 0 means instantaneous
+    tokens_per_second: float = 500
+    ## tokens per reply (per numbered line for batch translations)
+    completion_tokens: int = 40
+
+    @property
+    def _llm_type(self):
+        return "fake-local"
+
+    def _tokens(self, messages):
+        """
+        Deterministic reply tokens for a prompt
+        """
+        prompt = "\n".join(str(m.content) for m in messages)
+        numbers = _NUMBERED_LINE.findall(messages[-1].content) if messages else []
+
+        lines = []
+        for part in (numbers or [None]):
+            rng = random.Random(hashlib.sha1(f"{prompt}|{part}".encode("utf-8")).hexdigest())
+            words = [rng.choice(_VOCABULARY) for _ in range(self.completion_tokens)]
+            lines.append(([f"[{part}]"] if part else []) + words)
+
+        tokens = []
+        for i, line in enumerate(lines):
+            for j, word in enumerate(line):
+                tokens.append(("\n" if i and not j else (" " if j else "")) + word)
+        return tokens
+
+    def _wait(self, index):
+        """
+        Simulates the time it takes to produce token `index`
+        """
+        if index == 0:
+            time.sleep(self.latency)
+        elif self.tokens_per_second:
+            time.sleep(1.0 / self.tokens_per_second)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self.latency + (len(tokens) / self.tokens_per_second if self.tokens_per_second else 0))
+        message = AIMessage(content = "".join(tokens))
+        return ChatResult(
+            generations = [ChatGeneration(message = message)],
+            llm_output = {"token_usage": {"prompt_tokens": sum(len(str(m.content)) // 4 for m in messages),
+                                          "completion_tokens": len(tokens)},
+                          "model_name": self.model_name}
+        )
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens(messages)):
+            self._wait(i)
+            yield ChatGenerationChunk(message = AIMessageChunk(content = token))
+
+
+def build_fake_llm(model, temperature):
+    """
+    Engine builder for llm_pool, configured through the environment variables
+    FAKE_LLM_LATENCY, FAKE_LLM_TOKENS_PER_SECOND and FAKE_LLM_COMPLETION_TOKENS
+    """
+    return FakeChatModel(
+        model_name = model,
+        temperature = temperature,
+        latency = float(os.getenv("FAKE_LLM_LATENCY", 0.05)),
+        tokens_per_second = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", 500)),
+        completion_tokens = int(os.getenv("FAKE_LLM_COMPLETION_TOKENS", 40))
+    )
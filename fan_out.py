@@ -0,0 +1,112 @@
+## multi-variant generation: one scenario rendered in several target languages and / or proficiency levels at once
+## every variant is a complete session (script, translation, summary) generated like in batch_generate.py.
+## The variants run concurrently and all of their LLM calls go through the shared scheduler, so the total latency
+## is close to the one of a single session while the provider quota is still respected.
+##
+## usage:
+##   python fan_out.py spec.json --languages English German Spanish French
+##   python fan_out.py spec.json --levels Beginner Intermediate Advanced --output variants.json
+##
+## spec.json holds one spec in the format of batch_generate.py
+import argparse
+import itertools
+import json
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from batch_generate import DEFAULT_ENGINE, generate_session
+from instrumentation import bind
+
+## variants generated at the same time
+VARIANT_WORKERS = 8
+
+
+def variant_specs(spec, languages = None, proficiency_levels = None):
+    """
+    One spec per (language, proficiency level) combination, unspecified dimensions keep the spec's value
+    """
+    variants = []
+    for language, level in itertools.product(languages or [spec["language"]], proficiency_levels or [spec["proficiency_level"]]):
+        variant = dict(spec, language = language, proficiency_level = level)
+        variant["id"] = f"{spec.get('id', 'variant')}-{language}-{level}"
+        variants.append(variant)
+    return variants
+
+
+def align(variants):
+    """
+    Lines the variants' scripts up by exchange round.
+    Variants that closed their scene earlier have None for the remaining rounds
+
+    Outputs:
+    ------------
+    list with one entry per round, each a list with the (role1 line, role2 line) pair of every variant
+    """
+    rounds = max((len(v["script"]) // 2 for v in variants), default = 0)
+    return [[tuple(v["script"][2 * i:2 * i + 2]) if 2 * i + 1 < len(v["script"]) else None for v in variants]
+            for i in range(rounds)]
+
+
+def generate_variants(spec, languages = None, proficiency_levels = None, engine = DEFAULT_ENGINE, workers = VARIANT_WORKERS):
+    """
+    Generates all variants of spec concurrently
+
+    Output:
+    dict with the variants (language, proficiency_level, script, summary and error, if the variant failed),
+    their scripts aligned by round and the total seconds taken
+    """
+    specs = variant_specs(spec, languages, proficiency_levels)
+
+    def task(variant):
+        try:
+            result = generate_session(variant, engine)
+            result["error"] = None
+        except Exception:
+            result = {"id" : variant["id"], "spec" : variant, "script" : [], "summary" : None,
+                      "error" : traceback.format_exc()}
+        result["language"] = variant["language"]
+        result["proficiency_level"] = variant["proficiency_level"]
+        return result
+
+    start = time.perf_counter()
+    ## bind keeps the caller's session and priority for the scheduler and the instrumentation,
+    ## every task needs its own copy of the context
+    with ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "variant") as pool:
+        futures = [pool.submit(bind(task), variant) for variant in specs]
+        variants = [future.result() for future in futures]
+    return {
+        "variants" : variants,
+        "rounds" : align(variants),
+        "seconds" : time.perf_counter() - start,
+    }
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Render one scenario in several languages / proficiency levels")
+    parser.add_argument("spec", help = "scenario spec, a JSON file in the batch_generate.py format")
+    parser.add_argument("--languages", nargs = "+", help = "target languages, default: the spec's language")
+    parser.add_argument("--levels", nargs = "+", help = "proficiency levels, default: the spec's level")
+    parser.add_argument("--workers", type = int, default = VARIANT_WORKERS, help = "variants generated concurrently")
+    parser.add_argument("--engine", default = DEFAULT_ENGINE, help = "backbone LLM engine")
+    parser.add_argument("--output", help = "write the result to this JSON file instead of stdout")
+    args = parser.parse_args(argv)
+
+    with open(args.spec, encoding = "utf-8") as f:
+        spec = json.load(f)
+    result = generate_variants(spec, args.languages, args.levels, engine = args.engine, workers = args.workers)
+
+    output = json.dumps(result, ensure_ascii = False, indent = 2)
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    failed = [v["id"] for v in result["variants"] if v["error"]]
+    print(f"generated {len(result['variants']) - len(failed)} variants in {result['seconds']:.1f} s, {len(failed)} failed",
+          file = sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+## per-call instrumentation of every LLM and TTS call
+## each call is recorded as a span (stage, role, model, prompt/completion tokens, latency, cache hit, retries)
+## and aggregated per session and per stage, so we can see which stage dominates latency under real load.
+## Aggregates can be exported as JSON or in the Prometheus text format.
+##
+## the session a span belongs to is taken from a context variable, set with set_session() / session_scope().
+## Work handed to thread pools has to be wrapped with bind() to keep the session.
+import contextvars
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+## number of raw spans kept for inspection, aggregates are kept for every span
+MAX_SPANS = 10000
+## number of sessions whose aggregates are kept, the least recently active ones are forgotten first.
+## Sessions that end without a Reset never call drop_session(), so this keeps the tracer bounded
+MAX_SESSIONS = 1000
+
+_session = contextvars.ContextVar("session", default = None)
+_span = contextvars.ContextVar("span", default = None)
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate (about 4 characters per token), good enough for budgeting and reporting
+    """
+    return (len(text) + 3) // 4
+
+
+def set_session(session_id):
+    """
+    Attributes all following spans of the current thread / context to session_id
+    """
+    _session.set(session_id)
+
+
+def current_session():
+    return _session.get()
+
+
+def current_span():
+    """
+    The innermost span being recorded, e.g. to count retries of the traced call
+    """
+    return _span.get()
+
+
+@contextmanager
+def session_scope(session_id):
+    """
+    Attributes spans recorded inside the block to session_id
+    """
+    token = _session.set(session_id)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def bind(fn):
+    """
+    Wraps fn so that it runs with the caller's session when executed in another thread
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+class Span:
+    """
+    One instrumented call
+    """
+    __slots__ = ('stage', 'role', 'model', 'session', 'prompt_tokens', 'completion_tokens',
+                 'latency', 'cache_hit', 'retries', 'error', 'start')
+
+    def __init__(self, stage, role = None, model = None, prompt_tokens = 0):
+        self.stage = stage
+        self.role = role
+        self.model = model
+        self.session = current_session()
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = 0
+        self.latency = 0.0
+        self.cache_hit = False
+        self.retries = 0
+        self.error = None
+        self.start = time.time()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _empty_stats():
+    return {'calls' : 0, 'latency' : 0.0, 'max_latency' : 0.0, 'prompt_tokens' : 0,
+            'completion_tokens' : 0, 'cache_hits' : 0, 'retries' : 0, 'errors' : 0, 'spent_tokens' : 0}
+
+
+class Tracer:
+    """
+    Collects spans and aggregates them per session and stage
+    """
+    def __init__(self, max_spans = MAX_SPANS, max_sessions = MAX_SESSIONS):
+        self.spans = deque(maxlen = max_spans)
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        ## session -> stage -> stats, the None session holds the process-wide totals,
+        ## ordered from the least to the most recently active session
+        self._stats = OrderedDict()
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+            for session in {None, span.session}:
+                if session not in self._stats:
+                    self._stats[session] = defaultdict(_empty_stats)
+                self._stats.move_to_end(session)
+                stats = self._stats[session][span.stage]
+                stats['calls'] += 1
+                stats['latency'] += span.latency
+                stats['max_latency'] = max(stats['max_latency'], span.latency)
+                stats['prompt_tokens'] += span.prompt_tokens
+                stats['completion_tokens'] += span.completion_tokens
+                stats['cache_hits'] += span.cache_hit
+                stats['retries'] += span.retries
+                stats['errors'] += span.error is not None
+                ## tokens actually sent to / received from the provider, cache hits cost nothing
+                if not span.cache_hit:
+                    stats['spent_tokens'] += span.prompt_tokens + span.completion_tokens
+            ## the process-wide totals count as a session but are never forgotten
+            while len(self._stats) > self.max_sessions + 1:
+                oldest = next(session for session in self._stats if session is not None)
+                del self._stats[oldest]
+
+    def stage_stats(self, session = None):
+        """
+        Aggregates per stage, of one session or (session = None) of the whole process
+        """
+        with self._lock:
+            return {stage: dict(stats) for stage, stats in self._stats.get(session, {}).items()}
+
+    def spent_tokens(self, session):
+        """
+        Tokens a session actually spent on LLM / TTS calls, from the aggregates (not limited to the kept spans)
+        """
+        with self._lock:
+            return sum(stats['spent_tokens'] for stats in self._stats.get(session, {}).values())
+
+    def session_spans(self, session):
+        with self._lock:
+            return [span for span in self.spans if span.session == session]
+
+    def export_json(self, session = None, include_spans = False):
+        """
+        Aggregates (and optionally the raw spans) as a JSON string
+        """
+        report = {'session' : session, 'stages' : self.stage_stats(session)}
+        if include_spans:
+            with self._lock:
+                spans = [span.to_dict() for span in self.spans if session is None or span.session == session]
+            report['spans'] = spans
+        return json.dumps(report, ensure_ascii = False, indent = 2, default = str)
+
+    def export_prometheus(self):
+        """
+        Process-wide aggregates in the Prometheus text exposition format
+        """
+        metrics = [
+            ('llm_calls_total', 'counter', 'Number of calls', 'calls'),
+            ('llm_latency_seconds_sum', 'counter', 'Total call latency in seconds', 'latency'),
+            ('llm_latency_seconds_max', 'gauge', 'Slowest call in seconds', 'max_latency'),
+            ('llm_prompt_tokens_total', 'counter', 'Prompt tokens sent', 'prompt_tokens'),
+            ('llm_completion_tokens_total', 'counter', 'Completion tokens received', 'completion_tokens'),
+            ('llm_cache_hits_total', 'counter', 'Calls served from cache', 'cache_hits'),
+            ('llm_retries_total', 'counter', 'Retried calls', 'retries'),
+            ('llm_errors_total', 'counter', 'Failed calls', 'errors'),
+        ]
+        stats = self.stage_stats()
+        lines = []
+        for name, kind, help_text, field in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for stage, values in sorted(stats.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {values[field]}')
+        return "\n".join(lines) + "\n"
+
+    def drop_session(self, session):
+        """
+        Forgets the aggregates of a finished session
+        """
+        with self._lock:
+            self._stats.pop(session, None)
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self._stats.clear()
+
+
+TRACER = Tracer()
+
+
+@contextmanager
+def trace(stage, role = None, model = None, prompt_tokens = 0):
+    """
+    Records the enclosed call as a span, the span is yielded so the caller can fill in
+    completion_tokens, cache_hit and retries
+    """
+    span = Span(stage, role, model, prompt_tokens)
+    token = _span.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    except Exception as exc:
+        span.error = type(exc).__name__
+        raise
+    finally:
+        span.latency = time.perf_counter() - start
+        _span.reset(token)
+        TRACER.record(span)
@@ -0,0 +1,46 @@
+## lazy module loading for a fast cold start
+## the LLM / TTS stack (langchain, provider clients, gTTS, streamlit_chat) takes about a second to import.
+## The app only needs it once the user clicks Generate, Translate or Play audio, so it refers to these modules
+## through a LazyModule that imports on first attribute access. The sidebar renders before any of them is loaded.
+import importlib
+import threading
+import time
+
+## module name -> seconds its first import took, e.g. for the startup benchmark
+IMPORT_TIMES = {}
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported the first time one of its attributes is used
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        ## background workers (prefetch, speculative generation) may touch the module concurrently
+        with self._lock:
+            if self._module is None:
+                start = time.perf_counter()
+                self._module = importlib.import_module(self._name)
+                IMPORT_TIMES[self._name] = time.perf_counter() - start
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attribute):
+        return getattr(self._module or self._load(), attribute)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}' ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+def lazy_import(name):
+    """
+    Returns a LazyModule for name, the import itself happens on first use
+    """
+    return LazyModule(name)
@@ -0,0 +1,186 @@
+## saved lessons: a complete session (settings, transcript, translations, summary and audio) in one compact file
+## so a lesson can be reopened without calling the LLM or the TTS service again.
+##
+## file layout (little endian):
+##   MAGIC                      8 bytes
+##   version, meta size, body size   3 x uint32
+##   meta                       JSON - settings and a few numbers, enough to list a library of lessons
+##   body                       zlib compressed JSON - transcript, translations, summary and the audio index
+##   audio                      the audio clips, concatenated
+##
+## files are opened with mmap: listing a library only reads the meta section of every file and
+## audio clips are only copied out of the mapping when they are played
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+import uuid
+import zlib
+
+MAGIC = b"LLLESSON"
+VERSION = 1
+_HEADER = struct.Struct("<III")
+LESSON_SUFFIX = ".lesson"
+
+
+def save_lesson(path, settings, transcript, summary, audio_format = None):
+    """
+    Writes a complete lesson to path. The file is written to a temporary name first and then renamed,
+    so a library never contains half-written lessons
+
+    Output:
+    path
+    """
+    utterances = list(transcript)
+    audio_index, clips, offset = [], [], 0
+    for u in utterances:
+        if u.audio is None:
+            audio_index.append(None)
+        else:
+            audio_index.append([offset, len(u.audio)])
+            clips.append(u.audio)
+            offset += len(u.audio)
+
+    meta = json.dumps({
+        'settings' : settings,
+        'utterances' : len(utterances),
+        'audio_format' : audio_format,
+        'created' : time.time(),
+    }, ensure_ascii = False).encode("utf-8")
+    body = zlib.compress(json.dumps({
+        'transcript' : [[u.speaker, u.role, u.content, u.translation] for u in utterances],
+        'summary' : summary,
+        'audio' : audio_index,
+    }, ensure_ascii = False).encode("utf-8"), 9)
+
+    ## a temporary file of its own per save, concurrent saves never write to the same file
+    with tempfile.NamedTemporaryFile(dir = os.path.dirname(path) or ".", suffix = ".tmp", delete = False) as f:
+        try:
+            f.write(MAGIC)
+            f.write(_HEADER.pack(VERSION, len(meta), len(body)))
+            f.write(meta)
+            f.write(body)
+            for clip in clips:
+                f.write(clip)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+    return path
+
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a saved lesson file!")
+    version, meta_size, body_size = _HEADER.unpack(f.read(_HEADER.size))
+    if version != VERSION:
+        raise KeyError("Currently unsupported lesson file version!")
+    return meta_size, body_size
+
+
+def read_meta(path):
+    """
+    Settings and summary numbers of a saved lesson, without reading its transcript or audio
+    """
+    with open(path, "rb") as f:
+        meta_size, _ = _read_header(f)
+        return json.loads(f.read(meta_size).decode("utf-8"))
+
+
+def lesson_title(settings):
+    """
+    Short human readable description of a lesson
+    """
+    roles = settings['role_dict']
+    if settings['learning_mode'] == 'Conversation':
+        title = f"{roles['role1']['name']} and {roles['role2']['name']} {settings['scenario']}"
+    else:
+        title = f"Debate: {settings['scenario']}"
+    return f"{title} ({settings['language']}, {settings['proficiency_level']}, {settings['session_length']})"
+
+
+def lesson_filename(settings):
+    """
+    File name for a new lesson, derived from its settings and the current time.
+    A random suffix keeps lessons with the same settings saved in the same second apart
+    """
+    slug = re.sub(r"[^\w]+", "-", f"{settings['learning_mode']} {settings['scenario']} {settings['language']}").strip("-")
+    return f"{slug.lower()[:60]}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}{LESSON_SUFFIX}"
+
+
+def list_lessons(directory):
+    """
+    Saved lessons of a directory, newest first
+
+    Outputs:
+    ------------
+    list of (path, meta) pairs
+    """
+    if not os.path.isdir(directory):
+        return []
+    lessons = []
+    for name in os.listdir(directory):
+        if name.endswith(LESSON_SUFFIX):
+            path = os.path.join(directory, name)
+            try:
+                lessons.append((path, read_meta(path)))
+            except (OSError, ValueError, KeyError):
+                ## unreadable or foreign files are skipped
+                continue
+    return sorted(lessons, key = lambda lesson: -lesson[1]['created'])
+
+
+class SavedLesson:
+    """
+    A lesson opened from disk, with the attributes the app reads from a DualChatbot session
+    (transcript, language) plus its settings and summary.
+    Audio clips stay in the memory-mapped file until fill_audio() is called
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        meta_size, body_size = _read_header(self._file)
+        self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        start = len(MAGIC) + _HEADER.size
+        meta = json.loads(self._map[start:start + meta_size].decode("utf-8"))
+        body = json.loads(zlib.decompress(self._map[start + meta_size:start + meta_size + body_size]).decode("utf-8"))
+        self._audio_start = start + meta_size + body_size
+
+        self.settings = meta['settings']
+        self.audio_format = meta['audio_format']
+        self.language = self.settings['language']
+        self.summary = body['summary']
+        self._audio_index = body['audio']
+
+        ## imported here, listing a library doesn't need the transcript classes
+        from transcript import Transcript
+        self.transcript = Transcript()
+        for speaker, role, content, translation in body['transcript']:
+            self.transcript.append(speaker, role, content).translation = translation
+
+    def audio(self, position):
+        """
+        Audio bytes of the utterance at position, None if the lesson was saved without it
+        """
+        entry = self._audio_index[position]
+        if entry is None:
+            return None
+        offset, size = entry
+        return self._map[self._audio_start + offset:self._audio_start + offset + size]
+
+    def fill_audio(self):
+        """
+        Copies the saved audio clips into the transcript's utterances
+        """
+        for position, utterance in enumerate(self.transcript):
+            if utterance.audio is None:
+                utterance.audio = self.audio(position)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,197 @@
+## persistent, content-addressed cache for LLM outputs
+## entries are keyed by a hash of the fully rendered prompt plus the model parameters,
+## so identical requests (same settings, same history) are served from disk instead of calling the LLM again.
+## The cache is a single SQLite file shared by every session / process, bounded in size (LRU eviction) and age (TTL)
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from instrumentation import trace, estimate_tokens
+from scheduler import COMPLETION_TOKEN_ESTIMATE
+from resilience import resilient_call
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.sqlite")
+## 256 MB
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+## one week
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def make_key(*parts):
+    """
+    Hashes arbitrary JSON-serialisable parts into a cache key
+    """
+    payload = json.dumps(parts, ensure_ascii = False, sort_keys = True, default = str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def llm_fingerprint(llm):
+    """
+    Describes the model parameters that influence an LLM's output
+    """
+    return [type(llm).__name__, getattr(llm, "model_name", None), getattr(llm, "temperature", None)]
+
+
+class LLMCache:
+    """
+    SQLite backed key-value store with size-bounded LRU eviction and a TTL.
+    Values can be str (LLM outputs) or bytes (e.g. audio)
+    """
+    def __init__(self, path = DEFAULT_CACHE_PATH, max_bytes = DEFAULT_MAX_BYTES, ttl = DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        ## ttl = None keeps entries until they are evicted
+        self.ttl = ttl
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False, timeout = 30, isolation_level = None)
+        ## WAL lets several app processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is missing or expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            value, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.stats['hits'] += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Stores value under key and evicts the least recently used entries if the cache grew too large
+        """
+        size = len(value.encode("utf-8")) if isinstance(value, str) else len(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self.stats['writes'] += 1
+            self._evict()
+
+    def _evict(self):
+        """
+        Drops the least recently used entries until the cache is below 90% of max_bytes
+        """
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = 0.9 * self.max_bytes
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if total <= target:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+        self.stats['evictions'] += len(stale)
+
+    def clear(self):
+        """
+        Removes all entries
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the process-wide cache, configured through environment variables:
+    LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL (seconds) and LLM_CACHE_DISABLED.
+    Returns None when caching is disabled
+    """
+    global _default_cache
+    if os.getenv("LLM_CACHE_DISABLED"):
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache(
+                path = os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_bytes = int(os.getenv("LLM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+                ttl = float(os.getenv("LLM_CACHE_TTL", DEFAULT_TTL))
+            )
+    return _default_cache
+
+
+def lookup(llm, rendered_prompt):
+    """
+    Returns the cached output for `rendered_prompt` sent to `llm`, or None
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    return cache.get(make_key(llm_fingerprint(llm), rendered_prompt))
+
+
+def store(llm, rendered_prompt, output):
+    """
+    Records the output of `rendered_prompt` sent to `llm`
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.put(make_key(llm_fingerprint(llm), rendered_prompt), output)
+
+
+def prompt_size(rendered_prompt):
+    """
+    Estimated tokens of a rendered prompt, either a string or a list of (type, content) messages
+    """
+    if isinstance(rendered_prompt, str):
+        return estimate_tokens(rendered_prompt)
+    return sum(estimate_tokens(content) for _, content in rendered_prompt)
+
+
+def cached_call(llm, rendered_prompt, compute, stage = "llm", role = None):
+    """
+    Returns the cached output for `rendered_prompt` sent to `llm`,
+    otherwise runs compute() through the shared scheduler, with a deadline and retries, and stores its output.
+    The call is recorded as an instrumentation span of the given stage
+    """
+    prompt_tokens = prompt_size(rendered_prompt)
+    with trace(stage, role, llm_fingerprint(llm)[1], prompt_tokens) as span:
+        output = lookup(llm, rendered_prompt)
+        if output is None:
+            ## admitted by the shared scheduler, the deadline only covers the provider request
+            output = resilient_call(compute, prompt_tokens + COMPLETION_TOKEN_ESTIMATE)
+            store(llm, rendered_prompt, output)
+        else:
+            span.cache_hit = True
+        span.completion_tokens = estimate_tokens(output)
+    return output
+
+
+def cached_predict(chain, stage, **inputs):
+    """
+    Cached version of LLMChain.predict, keyed by the rendered prompt and the chain's model parameters
+    """
+    return cached_call(chain.llm, chain.prompt.format(**inputs), lambda: chain.predict(**inputs), stage = stage)
@@ -0,0 +1,142 @@
+## process-wide registry of LLM clients and prompt chains
+## every Chatbot / DualChatbot instance (and every Streamlit session living in the same process)
+## shares one client per (engine, model, temperature), so HTTP connections and TLS sessions are reused
+## instead of building a new client for every message
+##
+## the provider SDKs and langchain are only imported, and .env only read, when the first client is built,
+## so importing this module costs nothing at startup
+import os
+import threading
+from collections import Counter
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+
+_lock = threading.RLock()
+_clients = {}
+_chains = {}
+## counts how often a client / chain had to be built versus how often an existing one was reused
+_stats = Counter()
+_env_loaded = False
+
+
+def load_env():
+    """
+    Reads the .env file into the environment, once per process
+    """
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def _build_groq(model, temperature):
+    """
+    LLaMA via GroqCloud, needs the GROQ_API_KEY environment variable
+    """
+    from langchain_groq import ChatGroq
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("GROQ_API_KEY environment variable not set. Please set the API key.")
+    return ChatGroq(
+        temperature = temperature,
+        api_key = api_key,
+        model = model
+    )
+
+
+def _build_local(model, temperature):
+    """
+    Deterministic local fake model for offline benchmarks and tests, see fake_llm.py
+    """
+    from fake_llm import build_fake_llm
+    return build_fake_llm(model, temperature)
+
+
+## engine name -> builder(model, temperature) returning a LangChain chat model
+ENGINES = {
+    "GroqCloud" : _build_groq,
+    "Local" : _build_local,
+}
+
+
+def register_engine(name, builder):
+    """
+    Makes a chat model backend available as `engine` for Chatbot / DualChatbot
+    """
+    ENGINES[name] = builder
+
+
+def _build_llm(engine, model, temperature):
+    """
+    Instantiates a new chat model client for the given engine
+    """
+    if engine not in ENGINES:
+        raise KeyError("Currently unsupported chat model type!")
+    load_env()
+    return ENGINES[engine](model, temperature)
+
+
+def get_llm(engine, model = DEFAULT_MODEL, temperature = 0):
+    """
+    Returns the shared chat model client for (engine, model, temperature),
+    building it on first use
+    """
+    key = (engine, model, temperature)
+    with _lock:
+        llm = _clients.get(key)
+        if llm is None:
+            llm = _build_llm(engine, model, temperature)
+            _clients[key] = llm
+            _stats['client_builds'] += 1
+        else:
+            _stats['client_reuses'] += 1
+    return llm
+
+
+def get_chain(engine, name, prompt, model = DEFAULT_MODEL, temperature = 0):
+    """
+    Returns the shared LLMChain that feeds the precompiled `prompt` to the shared client.
+    `name` identifies the prompt, chains are keyed by (engine, model, temperature, name)
+    """
+    key = (engine, model, temperature, name)
+    with _lock:
+        chain = _chains.get(key)
+        if chain is None:
+            from langchain.chains import LLMChain
+            chain = LLMChain(llm = get_llm(engine, model, temperature), prompt = prompt)
+            _chains[key] = chain
+            _stats['chain_builds'] += 1
+        else:
+            _stats['chain_reuses'] += 1
+    return chain
+
+
+def reset_pool():
+    """
+    Drops all shared clients / chains and zeroes the counters (used by benchmarks)
+    """
+    with _lock:
+        _clients.clear()
+        _chains.clear()
+        _stats.clear()
+
+
+def pool_stats():
+    """
+    Returns reuse counters of the registry
+
+    Output:
+    ------------
+    dict with number of live clients / chains and how often they were built or reused
+    """
+    with _lock:
+        stats = {
+            'clients' : len(_clients),
+            'chains' : len(_chains),
+            'client_builds' : _stats['client_builds'],
+            'client_reuses' : _stats['client_reuses'],
+            'chain_builds' : _stats['chain_builds'],
+            'chain_reuses' : _stats['chain_reuses'],
+        }
+    return stats
@@ -0,0 +1,339 @@
+## load test of the Streamlit app: N simulated learners use one app.py process at the same time,
+## offline against the local fake LLM and the tone TTS backend. Every learner is a headless AppTest session that
+## fills in the sidebar, generates a conversation (streamed and paced like in the browser), waits for the summary
+## and then asks for the translation and the audio, like a learner working through a lesson.
+## reports:
+## - throughput (sessions per minute, messages per second)
+## - p50 / p95 / p99 time to first message and time to summary, as recorded by the app (see mark_timing in app.py)
+## - p50 / p95 / p99 latency of the Translate / Play audio reruns
+## - resident memory of the process before, at the peak and after the run, and the growth per learner
+##
+## usage:
+##   python loadtest.py --users 20
+##   python loadtest.py --users 50 --ramp 10 --sessions 2 --reading-speed 1000 --json load.json
+##
+## all learners share the process, like the sessions of one deployed app: the shared LLM scheduler, the TTS
+## synthesizer and the st.cache_resource objects. Use --reading-speed to speed up the message pacing,
+## the default paces messages like the app does
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import warnings
+warnings.filterwarnings("ignore")
+
+LANGUAGES = ['English', 'German', 'Spanish', 'French']
+PROFICIENCY_LEVELS = ['Beginner', 'Intermediate', 'Advanced']
+PERCENTILES = [50, 95, 99]
+## seconds between two memory samples
+MEMORY_SAMPLE_INTERVAL = 0.5
+## Streamlit version shared_runtime() was written against, the app itself only needs a lower bound (see requirements.txt)
+STREAMLIT_VERSION = "1.65.0"
+
+
+def rss_mb():
+    """
+    Current resident memory of the process in MB (peak resident memory where /proc is not available)
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## kB on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class MemorySampler:
+    """
+    Samples the resident memory in a background thread while the load test runs
+    """
+    def __init__(self, interval = MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = "memory-sampler", daemon = True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+
+def percentile(values, p):
+    """
+    p-th percentile of values with linear interpolation, None for no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+@contextlib.contextmanager
+def shared_runtime():
+    """
+    Makes the AppTest sessions of the learners share one Streamlit server, like the sessions of a deployed app.
+    AppTest installs a mock runtime when a script run starts and removes it when the run ends, which would pull it
+    away from the runs of the other learners that are still going: a missing runtime falls back to the last one installed.
+    AppTest also compiles the script again for every run with a new ScriptCache, where a server compiles it once:
+    all runs share one ScriptCache here (concurrent compiles also crash CPython 3.11 with
+    "SystemError: AST constructor recursion depth mismatch").
+    The "global.appTest" option AppTest switches on for a run is kept on for the whole load test,
+    a run that ends would switch it off under the runs of the other learners.
+
+    Both patch Streamlit internals, so the load test only runs with the exact version it was written against
+    """
+    import streamlit
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1.util import patch_config_options
+
+    if streamlit.__version__ != STREAMLIT_VERSION:
+        raise RuntimeError(f"loadtest.py patches Streamlit {STREAMLIT_VERSION} internals, "
+                           f"Streamlit {streamlit.__version__} is installed!")
+    original = Runtime.__dict__['instance'], Runtime.__dict__['exists'], ScriptCache.get_bytecode
+    script_cache = ScriptCache()
+    last = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+            return cls._instance
+        if last:
+            return last[0]
+        raise RuntimeError("Runtime hasn't been created!")
+
+    def get_bytecode(self, script_path):
+        return original[2](script_cache, script_path)
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or bool(last))
+    ScriptCache.get_bytecode = get_bytecode
+    try:
+        with patch_config_options({"global.appTest": True}):
+            yield
+    finally:
+        Runtime.instance, Runtime.exists, ScriptCache.get_bytecode = original
+
+
+def learner_spec(learner, session):
+    """
+    Settings of one simulated session. Scenarios differ per learner and session, so no two sessions share a prompt
+    """
+    return {
+        'Role 1 🎭' : 'Customer',
+        'Action 1 🗣️' : 'ordering a coffee',
+        'Role 2 🎭' : 'Waiter',
+        'Action 2 🗣️' : 'taking the order',
+        'Scenario 🎥' : f"in a cafe (learner {learner}, session {session})",
+        'Target Language 🔤' : LANGUAGES[learner % len(LANGUAGES)],
+        'Proficiency Level 🏆' : PROFICIENCY_LEVELS[learner % len(PROFICIENCY_LEVELS)],
+        'Session Length ⏰' : 'Short',
+    }
+
+
+def _widget(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise KeyError(f"No widget labelled '{label}' in the app!")
+
+
+def simulate_learner(app_path, learner, sessions = 1, timeout = 600):
+    """
+    Runs `sessions` lessons one after the other in one app session: generate, read the summary,
+    translate, play the audio, reset
+
+    Output:
+    list with one dict per session: seconds to the first message and to the summary, seconds of the
+    translate / audio reruns, number of messages and the error, if the session failed
+    """
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(app_path, default_timeout = timeout)
+    results = []
+    try:
+        app.run()
+        for session in range(sessions):
+            result = {'learner' : learner, 'session' : session, 'error' : None}
+            try:
+                for label, value in learner_spec(learner, session).items():
+                    widgets = app.sidebar.selectbox if label in ('Target Language 🔤', 'Proficiency Level 🏆', 'Session Length ⏰') \
+                              else app.sidebar.text_input
+                    _widget(widgets, label).set_value(value)
+                app.run()
+
+                start = time.monotonic()
+                _widget(app.sidebar.button, 'Generate').click().run()
+                result['generate'] = time.monotonic() - start
+                if app.exception:
+                    raise RuntimeError(app.exception[0].value)
+                if 'timings' not in app.session_state:
+                    raise RuntimeError("the Generate run did not start a session")
+                timings = app.session_state['timings']
+                result['first_message'] = timings.get('first_message')
+                result['summary'] = timings.get('summary')
+                result['messages'] = len(app.session_state['dual_chatbots'].transcript)
+
+                for label, key in (('Translate to English', 'translate'), ('Play audio', 'audio')):
+                    start = time.monotonic()
+                    _widget(app.button, label).click().run()
+                    result[key] = time.monotonic() - start
+                    if app.exception:
+                        raise RuntimeError(app.exception[0].value)
+
+                _widget(app.sidebar.button, '🔄 Reset Session').click().run()
+            except Exception:
+                result['error'] = traceback.format_exc()
+            results.append(result)
+    except Exception:
+        results.append({'learner' : learner, 'session' : len(results), 'error' : traceback.format_exc()})
+    return results
+
+
+def run_load_test(users, sessions = 1, ramp = 0.0, app_path = None, timeout = 600, warmup = True):
+    """
+    Runs `users` simulated learners concurrently in this process, starting them evenly over `ramp` seconds.
+    With warmup one untimed session runs first, so imports and shared resources are in place like in a running app
+    and don't count towards the first learners' latency and the memory per learner
+
+    Output:
+    dict with the per-session results, throughput, latency percentiles and memory
+    """
+    app_path = app_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    results = []
+    lock = threading.Lock()
+
+    def learner(i):
+        time.sleep(ramp * i / users if users > 1 else 0)
+        learner_results = simulate_learner(app_path, i, sessions, timeout)
+        with lock:
+            results.extend(learner_results)
+
+    if warmup:
+        with shared_runtime():
+            simulate_learner(app_path, users, 1, timeout)
+    rss_before = rss_mb()
+    start = time.monotonic()
+    with shared_runtime(), MemorySampler() as memory:
+        threads = [threading.Thread(target = learner, args = (i,), name = f"learner-{i}") for i in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    seconds = time.monotonic() - start
+    rss_after = rss_mb()
+
+    completed = [r for r in results if r['error'] is None]
+
+    def stats(key):
+        values = [r[key] for r in completed if r.get(key) is not None]
+        return {f"p{p}" : percentile(values, p) for p in PERCENTILES} | {'mean' : statistics.fmean(values) if values else None}
+
+    return {
+        'users' : users,
+        'sessions_per_user' : sessions,
+        'seconds' : seconds,
+        'completed' : len(completed),
+        'failed' : len(results) - len(completed),
+        'sessions_per_minute' : len(completed) * 60 / seconds,
+        'messages_per_second' : sum(r['messages'] for r in completed) / seconds,
+        'first_message' : stats('first_message'),
+        'summary' : stats('summary'),
+        'translate' : stats('translate'),
+        'audio' : stats('audio'),
+        'memory_mb' : {
+            'before' : rss_before,
+            'peak' : memory.peak,
+            'after' : rss_after,
+            'per_user' : (rss_after - rss_before) / users,
+        },
+        'errors' : [r['error'] for r in results if r['error']][:5],
+        'results' : results,
+    }
+
+
+def format_report(result):
+    """
+    Renders a load test result as plain text
+    """
+    def row(name, s):
+        return f"  {name:<16}" + "".join(f"{s[f'p{p}']:>9.2f}" if s[f'p{p}'] is not None else f"{'-':>9}" for p in PERCENTILES)
+
+    memory = result['memory_mb']
+    lines = [
+        f"{result['users']} learners x {result['sessions_per_user']} sessions in {result['seconds']:.1f} s, "
+        f"{result['completed']} completed, {result['failed']} failed",
+        f"  throughput      {result['sessions_per_minute']:.1f} sessions / min, {result['messages_per_second']:.1f} messages / s",
+        f"  {'seconds':<16}" + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES),
+        row('first message', result['first_message']),
+        row('summary', result['summary']),
+        row('translate', result['translate']),
+        row('play audio', result['audio']),
+        f"  memory          {memory['before']:.0f} MB before, {memory['peak']:.0f} MB peak, {memory['after']:.0f} MB after, "
+        f"{memory['per_user']:.1f} MB per learner",
+    ]
+    for error in result['errors']:
+        lines.append("  error: " + error.strip().splitlines()[-1])
+    return "\n".join(lines)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Load test of the Streamlit app with concurrent simulated learners")
+    parser.add_argument("--users", type = int, default = 10, help = "concurrent simulated learners")
+    parser.add_argument("--sessions", type = int, default = 1, help = "lessons every learner generates one after the other")
+    parser.add_argument("--ramp", type = float, default = 0.0, help = "seconds over which the learners start")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "fake LLM seconds to first token")
+    parser.add_argument("--tokens-per-second", type = float, default = 500, help = "fake LLM throughput")
+    parser.add_argument("--completion-tokens", type = int, default = 40, help = "fake LLM tokens per reply")
+    parser.add_argument("--reading-speed", type = float, help = "words per second the messages are paced at, default: the app's")
+    parser.add_argument("--cache", action = "store_true", help = "keep the persistent LLM cache enabled")
+    parser.add_argument("--timeout", type = float, default = 600, help = "seconds a single script run may take")
+    parser.add_argument("--no-warmup", action = "store_true", help = "measure a cold process, without an untimed first session")
+    parser.add_argument("--json", help = "also write the results to this file")
+    args = parser.parse_args(argv)
+
+    os.environ["LLM_ENGINE"] = "Local"
+    os.environ["TTS_BACKEND"] = "tone"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.latency)
+    os.environ["FAKE_LLM_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["FAKE_LLM_COMPLETION_TOKENS"] = str(args.completion_tokens)
+    ## saved lessons of a real library would be indexed by every learner's first run
+    os.environ["LESSON_DIR"] = tempfile.mkdtemp(prefix = "loadtest-lessons-")
+    if args.reading_speed:
+        os.environ["READING_WORDS_PER_SECOND"] = str(args.reading_speed)
+    if not args.cache:
+        os.environ["LLM_CACHE_DISABLED"] = "1"
+
+    result = run_load_test(args.users, args.sessions, args.ramp, timeout = args.timeout, warmup = not args.no_warmup)
+    print(format_report(result))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent = 2)
+    return 1 if result['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
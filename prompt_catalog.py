@@ -0,0 +1,178 @@
+## catalog of the chatbots' prompt templates
+## the system message only depends on a handful of session settings: (learning mode, language, proficiency level,
+## session length, starter). Its template is compiled once per combination and shared by every bot of every session,
+## only the scenario and role slots are filled in per session when a turn is rendered.
+##
+## the number of exchanges per session length is configurable through the EXCHANGE_COUNTS environment variable,
+## a JSON object overriding the defaults, e.g. EXCHANGE_COUNTS='{"Long": {"Conversation": 24}}'
+import json
+import os
+import threading
+from functools import lru_cache
+from langchain.prompts import (
+    ChatPromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+    HumanMessagePromptTemplate
+)
+
+## Session Length
+## maximum number of exchanges that can happen in one session
+DEFAULT_EXCHANGE_COUNTS = {
+    'Short' : {'Conversation':8, 'Debate' : 4},
+    'Long' : {'Conversation':16, 'Debate': 8}
+}
+
+## Speech Length
+## Restrict how much a chat bot can say within one exchange or equivalently the number of messages
+## for conversation mode - "no need to restrict", for debate mode - "we need to impose a limit"
+ARGUMENT_NUMS = {
+    'Beginner' : 4,
+    'Intermediate' : 6,
+    'Advanced' : 8
+}
+
+## Speech Complexity
+LANGUAGE_REQUIREMENTS = {
+    'Beginner' : """
+            use a basic and simple vocabulary and sentence structures as possible.
+            Must avoid idioms, slang and complex grammatical constructs.
+            """,
+    'Intermediate' : """
+            use a wider range of vocabulary and variety of structures.
+            You can include some idioms and colloquial expressions,
+            but avoid highly technical language or complex literary expressions.
+            """,
+    'Advanced' : """
+            use sophisticated vocabulary , complex sentence structures , idoms, colloquial expressions,
+            and technical language where appropriate.                        
+            """,
+}
+
+def _merge_counts(overrides):
+    counts = {length: dict(modes) for length, modes in DEFAULT_EXCHANGE_COUNTS.items()}
+    for length, modes in overrides.items():
+        counts.setdefault(length, {}).update({mode: int(count) for mode, count in modes.items()})
+    return counts
+
+
+## resolved exchange counts, updated in place so every module importing it sees the configured values
+EXCHANGE_COUNTS = _merge_counts(json.loads(os.getenv("EXCHANGE_COUNTS", "{}")))
+_config_lock = threading.Lock()
+
+
+def configure_exchange_counts(overrides):
+    """
+    Overrides exchange counts, e.g. {'Long': {'Conversation': 24}}.
+    Templates compiled with the previous counts are dropped from the catalog
+    """
+    with _config_lock:
+        counts = _merge_counts(overrides)
+        EXCHANGE_COUNTS.clear()
+        EXCHANGE_COUNTS.update(counts)
+        get_prompt.cache_clear()
+
+
+def exchange_count(session_length, learning_mode):
+    """
+    Maximum number of exchange rounds of a session
+    """
+    if session_length not in EXCHANGE_COUNTS:
+        raise KeyError("Currently unsupported session length!")
+    if learning_mode not in EXCHANGE_COUNTS[session_length]:
+        raise KeyError("Currently unsupported learning mode!")
+    return EXCHANGE_COUNTS[session_length][learning_mode]
+
+
+def system_template(learning_mode, language, proficiency_level, session_length, starter):
+    """
+    we guide the chatbot in participating in the conversation as desired by the user
+    we have to specify the behavior of the chatbot , which consists of the following aspects:
+
+    - general context : conducting conversation / debate under given scenario
+    - the language spoken
+    - purpose of simulated conversation / debate
+    - language complexity requirement
+    - exchange length requirement
+    - other nuance constraints
+
+    Outputs:
+    ------------
+    template : instructions for chatbot, with the slots {scenario}, {role_name}, {role_action},
+               {oppo_name} and {oppo_action} left to be filled in per session
+
+    The string is fed into SystemMessagePromptTemplate.from_template()
+    """
+    if proficiency_level not in LANGUAGE_REQUIREMENTS:
+        raise KeyError("Currently unsupported proficiency level!")
+    lang_requirement = LANGUAGE_REQUIREMENTS[proficiency_level]
+    exchange_counts = exchange_count(session_length, learning_mode)
+
+    ## Compile Bot Instructions
+    if learning_mode == "Conversation":
+        prompt = f"""
+            You are an AI that is good at role-playing.
+            You are simulating a typical conversation happened {{scenario}}.
+            In this scenario, you are playing as a {{role_name}} {{role_action}}, speaking to a 
+            {{oppo_name}} {{oppo_action}}.
+            Your conversation should only be conducted in {language}. Do not translate.
+            This simulated {learning_mode} is designed for {language} language learners to learn real-life
+            conversations in {language}. You should assume the learner's proficiency level in
+            {language} is {proficiency_level}. Therefore , you should {lang_requirement}.
+            You should finish the conversation within {exchange_counts} exchanges with the {{oppo_name}}.
+            Make your conversation with {{oppo_name}} natural and typical in the considered scenario in
+            {language} cultural.
+            """
+    elif learning_mode == 'Debate':
+        prompt = f"""
+            You are an AI that is good at debating. 
+            You are now engaged in a debate with the following topic: {{scenario}}. 
+            In this debate, you are taking on the role of a {{role_name}}. 
+            Always remember your stances in the debate.
+            Your debate should only be conducted in {language}. Do not translate.
+            This simulated debate is designed for {language} language learners to learn {language}. 
+            You should assume the learners' proficiency level in {language} is {proficiency_level}. 
+            Therefore, you should {lang_requirement}.
+            You will exchange opinions with another AI (who plays the {{oppo_name}} role) {exchange_counts} times. 
+            Everytime you speak, you can only speak no more than {ARGUMENT_NUMS[proficiency_level]} sentences.
+            """
+    else:
+        raise KeyError("Currently unsupported learning mode!")
+
+    ## instruct the chatbot whether it should speak first or wait for the response from opponsent AI:
+    if starter:
+        ## current bot is first to speak
+        prompt += f"You are leading the {learning_mode}.\n"
+    else:
+        ## current bot is second one to speak
+        prompt += "Wait for the {oppo_name}'s statement"
+
+    return prompt
+
+
+@lru_cache(maxsize = 512)
+def get_prompt(learning_mode, language, proficiency_level, session_length, starter):
+    """
+    Returns the compiled chat prompt for these settings, built once and shared by all sessions.
+    Render it with format_messages(history = ..., input = ..., **slots(role, oppo_role, scenario))
+    """
+    return ChatPromptTemplate.from_messages([
+        ## system message controls the chatbot behavior
+        SystemMessagePromptTemplate.from_template(
+            system_template(learning_mode, language, proficiency_level, session_length, starter)),
+        MessagesPlaceholder(variable_name = "history"),
+        HumanMessagePromptTemplate.from_template("{input}")
+    ])
+
+
+def slots(role, oppo_role, scenario):
+    """
+    Per-session values of the system message slots
+    """
+    return {
+        'scenario' : scenario,
+        'role_name' : role['name'],
+        'role_action' : role.get('action', ''),
+        'oppo_name' : oppo_role['name'],
+        'oppo_action' : oppo_role.get('action', ''),
+    }
@@ -0,0 +1,173 @@
+## resilient LLM calls: per-call deadlines, retries with jittered backoff and optional hedged requests
+## every attempt first waits for the shared scheduler to admit it (see scheduler.py), the deadline only starts then,
+## so it covers the provider request and not the time spent queued behind other sessions or the rate limits.
+## A request that stalls is abandoned after its deadline and retried, transient errors (timeouts, dropped connections,
+## 5xx responses) are retried with exponential backoff. Rate-limit errors pause all callers through the scheduler.
+## With hedging, a duplicate request is sent when the first one hasn't answered after `hedge_after` seconds - only if
+## the scheduler can admit it right away - and whichever answers first wins, which cuts the latency tail.
+## Abandoned requests finish in the background and keep their scheduler slot until then, their results are dropped.
+##
+## configured through LLM_CALL_TIMEOUT (seconds, default 120), LLM_CALL_RETRIES (default 2)
+## and LLM_HEDGE_AFTER (seconds, hedging is off if unset)
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from queue import Queue, Empty
+from instrumentation import bind, current_span
+from scheduler import get_scheduler, is_rate_limit_error, BACKOFF_BASE, BACKOFF_MAX, MAX_RETRIES
+
+CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", 120))
+CALL_RETRIES = int(os.getenv("LLM_CALL_RETRIES", 2))
+HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER")) if os.getenv("LLM_HEDGE_AFTER") else None
+
+
+class CallTimeout(TimeoutError):
+    """
+    Raised when a call didn't answer within its deadline
+    """
+
+
+def is_transient_error(exc):
+    """
+    Errors worth another attempt: deadlines, network problems and server side errors.
+    Rate limits are not among them, they are handled by pausing the scheduler
+    """
+    if is_rate_limit_error(exc):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    name = type(exc).__name__
+    return any(marker in name for marker in ("Timeout", "Connection", "InternalServer", "ServiceUnavailable"))
+
+
+def _admitted(scheduler, fn):
+    """
+    Runs fn() in its own thread and releases its scheduler slot once the request has ended,
+    even if the caller stopped waiting for it
+
+    Output:
+    a Future of fn()'s result
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fn())
+        except BaseException as exc:
+            future.set_exception(exc)
+        finally:
+            scheduler.release()
+    threading.Thread(target = bind(run), name = "llm-call", daemon = True).start()
+    return future
+
+
+def _attempt(fn, tokens, timeout, hedge_after, scheduler):
+    """
+    One attempt of fn(): waits until the scheduler admits it, then gives it `timeout` seconds,
+    plus a hedged duplicate after hedge_after seconds
+    """
+    scheduler.acquire(tokens)
+    start = time.monotonic()
+    deadline = start + timeout
+    pending = {_admitted(scheduler, fn)}
+    hedged = hedge_after is None
+    error = None
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            raise CallTimeout(f"LLM call did not answer within {timeout:g} s")
+        wait_until = deadline if hedged else min(deadline, start + hedge_after)
+        done, pending = wait(pending, timeout = wait_until - now, return_when = FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = error or future.exception()
+        if not hedged and time.monotonic() >= start + hedge_after:
+            ## the request is slow (or failed): send a duplicate if it doesn't have to queue,
+            ## and take whichever answers first
+            hedged = True
+            if scheduler.try_acquire(tokens):
+                pending.add(_admitted(scheduler, fn))
+        if not pending:
+            raise error
+
+
+def _backoff(attempt):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+
+
+def resilient_call(fn, tokens, timeout = None, retries = None, hedge_after = None):
+    """
+    Runs fn(), an LLM request of about `tokens` tokens, through the shared scheduler with a deadline per attempt.
+    Transient errors are retried with jittered exponential backoff, rate-limit errors pause the scheduler for
+    all callers before the call is retried. Retries are counted on the current instrumentation span
+    """
+    timeout = timeout if timeout is not None else CALL_TIMEOUT
+    retries = retries if retries is not None else CALL_RETRIES
+    hedge_after = hedge_after if hedge_after is not None else HEDGE_AFTER
+    scheduler = get_scheduler()
+    attempt, rate_limited = 0, 0
+    while True:
+        try:
+            return _attempt(fn, tokens, timeout, hedge_after, scheduler)
+        except Exception as exc:
+            if is_rate_limit_error(exc) and rate_limited < MAX_RETRIES:
+                scheduler.report_rate_limit(exc, rate_limited)
+                rate_limited += 1
+            elif is_transient_error(exc) and attempt < retries:
+                attempt += 1
+                time.sleep(_backoff(attempt))
+            else:
+                raise
+        span = current_span()
+        if span is not None:
+            span.retries += 1
+
+
+_DONE = object()
+
+
+def resilient_stream(open_stream, tokens, timeout = None):
+    """
+    Yields the chunks of open_stream(), a streamed LLM request of about `tokens` tokens, once the scheduler admits it.
+    The reply has `timeout` seconds from admission: a stalled stream raises CallTimeout instead of hanging
+    its consumer. An abandoned stream is closed at its next chunk and releases its scheduler slot then
+    """
+    timeout = timeout if timeout is not None else CALL_TIMEOUT
+    scheduler = get_scheduler()
+    scheduler.acquire(tokens)
+    deadline = time.monotonic() + timeout
+    queue = Queue()
+    abandoned = threading.Event()
+
+    def pump():
+        try:
+            for chunk in open_stream():
+                if abandoned.is_set():
+                    break
+                queue.put(chunk)
+            queue.put(_DONE)
+        except BaseException as exc:
+            queue.put(exc)
+        finally:
+            scheduler.release()
+    threading.Thread(target = bind(pump), name = "llm-stream", daemon = True).start()
+
+    try:
+        while True:
+            try:
+                item = queue.get(timeout = max(0.0, deadline - time.monotonic()))
+            except Empty:
+                raise CallTimeout(f"LLM stream did not finish within {timeout:g} s")
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        abandoned.set()
@@ -0,0 +1,214 @@
+## process-wide scheduler for LLM calls
+## all sessions of the process submit their LLM calls here, so together they stay within the provider quota:
+## - token buckets limit requests per minute and tokens per minute
+## - at most `max_concurrent` calls run at the same time
+## - waiting calls are served by priority (interactive before batch) and round-robin across sessions,
+##   so one busy session can't starve the others
+## - a rate-limit error (429) pauses every caller with exponential backoff instead of letting all of them retry at once
+##
+## the scheduler only decides when calls may start, resilience.py runs the admitted calls with a deadline.
+## Configured through LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE and LLM_MAX_CONCURRENT
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from instrumentation import current_session
+
+INTERACTIVE = 0
+BATCH = 1
+
+## tokens reserved for the completion of a call on top of its prompt
+COMPLETION_TOKEN_ESTIMATE = 256
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+_priority = contextvars.ContextVar("priority", default = INTERACTIVE)
+
+
+@contextmanager
+def priority_scope(priority):
+    """
+    Submits the LLM calls made inside the block with the given priority (INTERACTIVE or BATCH)
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_rate_limit_error(exc):
+    """
+    Recognises rate-limit errors of the LLM providers
+    """
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    message = f"{type(exc).__name__} {exc}".lower()
+    return "ratelimit" in message or "rate limit" in message or "429" in message
+
+
+def _retry_after(exc):
+    """
+    Seconds the provider asked us to wait, if it told us
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute up to one minute worth of units
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount, now):
+        """
+        Seconds until `amount` units are available
+        """
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class _Ticket:
+    __slots__ = ('session', 'priority', 'tokens')
+
+    def __init__(self, session, priority, tokens):
+        self.session = session
+        self.priority = priority
+        self.tokens = tokens
+
+
+class Scheduler:
+    """
+    Admission control for LLM calls shared by all sessions of the process
+    """
+    def __init__(self, requests_per_minute = 1000, tokens_per_minute = 300000, max_concurrent = 32):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        ## priority -> session -> waiting tickets, sessions are served round-robin
+        self._waiting = {INTERACTIVE: OrderedDict(), BATCH: OrderedDict()}
+
+    def _head(self):
+        for priority in (INTERACTIVE, BATCH):
+            queue = self._waiting[priority]
+            if queue:
+                return queue[next(iter(queue))][0]
+        return None
+
+    def _wait_time(self, ticket, now):
+        """
+        Seconds until ticket may start, None if it has to wait for a running call to finish
+        """
+        if self.active >= self.max_concurrent:
+            return None
+        return max(self.paused_until - now,
+                   self.requests.wait_time(1, now),
+                   self.tokens.wait_time(ticket.tokens, now))
+
+    def acquire(self, tokens, priority = None, session = None):
+        """
+        Blocks until a call of `tokens` estimated tokens may start
+        """
+        ticket = _Ticket(session if session is not None else current_session(),
+                         priority if priority is not None else _priority.get(), tokens)
+        with self._cond:
+            queue = self._waiting[ticket.priority]
+            queue.setdefault(ticket.session, deque()).append(ticket)
+            while True:
+                wait = None
+                if self._head() is ticket:
+                    wait = self._wait_time(ticket, time.monotonic())
+                    if wait is not None and wait <= 0:
+                        break
+                self._cond.wait(timeout = wait if wait is not None else 1.0)
+
+            ## grant: take the ticket off its session queue and move the session to the back
+            session_queue = queue[ticket.session]
+            session_queue.popleft()
+            if session_queue:
+                queue.move_to_end(ticket.session)
+            else:
+                del queue[ticket.session]
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self.active += 1
+            self._cond.notify_all()
+
+    def try_acquire(self, tokens):
+        """
+        Admits a call of `tokens` estimated tokens only if nobody is waiting and it may start right away,
+        e.g. for a hedged duplicate request that must not jump the queue
+
+        Output:
+        True if the call was admitted (release() it when done)
+        """
+        with self._cond:
+            if any(self._waiting.values()):
+                return False
+            ticket = _Ticket(None, INTERACTIVE, tokens)
+            wait = self._wait_time(ticket, time.monotonic())
+            if wait is None or wait > 0:
+                return False
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def report_rate_limit(self, exc, attempt):
+        """
+        Pauses all callers after a rate-limit error, with exponential backoff and jitter
+        """
+        delay = _retry_after(exc)
+        if delay is None:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random() / 2)
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self._cond.notify_all()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Returns the process-wide scheduler
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(
+                requests_per_minute = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 1000)),
+                tokens_per_minute = float(os.getenv("LLM_TOKENS_PER_MINUTE", 300000)),
+                max_concurrent = int(os.getenv("LLM_MAX_CONCURRENT", 32))
+            )
+    return _scheduler
@@ -1,20 +1,15 @@
 ## import necessary libraries
-import os
-from langchain.prompts import (
-    ChatPromptTemplate,
-    MessagesPlaceholder,
-    SystemMessagePromptTemplate,
-    HumanMessagePromptTemplate
-)
-from langchain.chains import ConversationChain
-from langchain_groq import ChatGroq
-from langchain.memory import ConversationBufferMemory
-from dotenv import load_dotenv
-
-load_dotenv()
-api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY environment variable not set. Please set the API key.")
+from prompt_catalog import get_prompt, slots
+from llm_pool import get_llm
+from llm_cache import cached_call, lookup, store, llm_fingerprint
+from instrumentation import trace, estimate_tokens
+from scheduler import get_scheduler, is_rate_limit_error, COMPLETION_TOKEN_ESTIMATE
+from resilience import resilient_call, resilient_stream, is_transient_error
+from chat_memory import make_memory, count_message_tokens
+
+## Session Length
+## EXCHANGE_COUNTS - maximum number of exchanges per session length - lives in prompt_catalog.py
+## and is configurable through the EXCHANGE_COUNTS environment variable
 
 ## we will first define a single chat bot class which can be later integrated into a dual-chatbot class
 ## this chat bot class enable the management of an individual chatbot with user-specified LLM as its backbone
@@ -24,25 +19,24 @@ class Chatbot:
     """
     class definition for a single chatbot with memory, created with LangChain
     """
-    def __init__(self, engine):
+    def __init__(self, engine, memory_strategy = "buffer", memory_options = None, history_source = None):
         """
         select backbone LLM, as well as instantiate the memory for creating Language Chain in LangChain
+        memory_strategy selects how much history is resent with every turn, see chat_memory.py
+        history_source lets the chatbot read its history from a shared transcript view instead of a private log
         """
         
         ## instantiate LLM
-        if engine == "GroqCloud":
-            self.llm = ChatGroq(
-                temperature = 0,
-                api_key = api_key,
-                model = "llama-3.3-70b-versatile"
-            )
-        else:
-            raise KeyError("Currently unsupported chat model type")
+        ## the client is shared process-wide, so creating many chatbots doesn't create many connections
+        self.llm = get_llm(engine)
         
         ## instantiate memory
         ## This will track the conversation history
         ## This will prepends the last few inputs/outputs to the current input of the chat bot
-        self.memory = ConversationBufferMemory(return_messages=True)
+        self.memory = make_memory(memory_strategy, self.llm, history_source, **(memory_options or {}))
+
+        ## estimated prompt tokens sent on every turn
+        self.prompt_tokens = []
 
     def instruct(self, role, oppo_role, language, scenario, session_length, proficiency_level, learning_mode, starter = False):
         """
@@ -63,116 +57,65 @@ class Chatbot:
         self.starter = starter
 
         ## define prompt template
-        prompt = ChatPromptTemplate.from_messages([
-          ## system message controls the chatbot behavior
-          SystemMessagePromptTemplate.from_template(self._specify_system_message()),
-          MessagesPlaceholder(variable_name = "history"),
-          HumanMessagePromptTemplate.from_template("{input}")
-        ])
+        ## the compiled template is shared by all sessions with the same settings (see prompt_catalog.py),
+        ## only the scenario and role slots are specific to this bot
+        self.prompt = get_prompt(learning_mode, language, proficiency_level, session_length, starter)
+        self.prompt_slots = slots(role, oppo_role, scenario)
 
-        ## create conversation chain
-        self.conversation = ConversationChain(memory = self.memory, prompt = prompt, llm = self.llm, verbose = False)
-
-    def _specify_system_message(self):
+    def _render(self, input):
         """
-        we guide the chatbot in participating in the conversation as desired by the user
-        we have to specify the behavior of the chatbot , which consists of the following aspects:
-
-        - general context : conducting conversation / debate under given scenario
-        - the language spoken
-        - purpose of simulated conversation / debate
-        - language complexity requirement
-        - exchange length requirement
-        - other nuance constraints
-
-        Outputs:
-        ------------
-        prompt : instructions for chatbot
-
-        This method compiles a string which will then be fed into the SystemMessagePromptTemplate.from_template()
-        to instruct the chat bot
-        This method basically is used for a custom prompt design
+        Renders the full prompt (system message, history and input) of the next turn
         """
-        ## we specify each language learning requirements
-        
-        ## Session Length
-        ## directly specify the maximum number of exchanges that can happen in one session
-        ## numbers are hardcoded for time being
-        exchange_counts_dict = {
-            'Short' : {'Conversation':8, 'Debate' : 4},
-            'Long' : {'Conversation':16, 'Debate': 8}
-        }
-        exchange_counts = exchange_counts_dict[self.session_length][self.learning_mode]
-
-        ## Speech Length
-        ## Restrict how much a chat bot can say within one exchange or equivalently the number of messages
-        ## for conversation mode - "no need to restrict", for debate mode - "we need to impose a limit"
-        ## hardcoded numbers wrt to users proficiency level in the target language
-        argument_num_dict = {
-            'Beginner' : 4,
-            'Intermediate' : 6,
-            'Advanced' : 8
-        }
-
-        ## Speech Complexity
-
-        if self.proficiency_level == "Beginner":
-            lang_requirement = """
-            use a basic and simple vocabulary and sentence structures as possible.
-            Must avoid idioms, slang and complex grammatical constructs.
-            """
-        elif self.proficiency_level == "Intermediate":
-            lang_requirement = """
-            use a wider range of vocabulary and variety of structures.
-            You can include some idioms and colloquial expressions,
-            but avoid highly technical language or complex literary expressions.
-            """
-        elif self.proficiency_level == "Advanced":
-            lang_requirement = """
-            use sophisticated vocabulary , complex sentence structures , idoms, colloquial expressions,
-            and technical language where appropriate.                        
-            """
-        else:
-            raise KeyError("Currently unsupported proficiency level!")
-        
-        ## Compile Bot Instructions
-        if self.learning_mode == "Conversation":
-            prompt = f"""
-            You are an AI that is good at role-playing.
-            You are simulating a typical conversation happened {self.scenario}.
-            In this scenario, you are playing as a {self.role['name']} {self.role['action']}, speaking to a 
-            {self.oppo_role['name']} {self.oppo_role['action']}.
-            Your conversation should only be conducted in {self.language}. Do not translate.
-            This simulated {self.learning_mode} is designed for {self.language} language learners to learn real-life
-            conversations in {self.language}. You should assume the learner's proficiency level in
-            {self.language} is {self.proficiency_level}. Therefore , you should {lang_requirement}.
-            You should finish the conversation within {exchange_counts} exchanges with the {self.oppo_role['name']}.
-            Make your conversation with {self.oppo_role['name']} natural and typical in the considered scenario in
-            {self.language} cultural.
-            """
-        elif self.learning_mode == 'Debate':
-            prompt = f"""
-            You are an AI that is good at debating. 
-            You are now engaged in a debate with the following topic: {self.scenario}. 
-            In this debate, you are taking on the role of a {self.role['name']}. 
-            Always remember your stances in the debate.
-            Your debate should only be conducted in {self.language}. Do not translate.
-            This simulated debate is designed for {self.language} language learners to learn {self.language}. 
-            You should assume the learners' proficiency level in {self.language} is {self.proficiency_level}. 
-            Therefore, you should {lang_requirement}.
-            You will exchange opinions with another AI (who plays the {self.oppo_role['name']} role) {exchange_counts} times. 
-            Everytime you speak, you can only speak no more than {argument_num_dict[self.proficiency_level]} sentences.
-            """
-        else:
-            raise KeyError("Currently unsupported learning mode!")
+        messages = self.prompt.format_messages(history = self.memory.history(), input = input, **self.prompt_slots)
+        self.prompt_tokens.append(count_message_tokens(messages))
+        return messages
 
+    def predict(self, input):
+        """
+        Runs one turn of the conversation.
+        The reply is cached by the fully rendered prompt (system message, history and input),
+        on a cache hit no LLM call is made
+        """
+        messages = self._render(input)
+        rendered = [(m.type, m.content) for m in messages]
 
-        ## instruct the chatbot whether it should speak first or wait for the response from opponsent AI:
-        if self.starter:
-            ## current bot is first to speak
-            prompt += f"You are leading the {self.learning_mode}.\n"
-        else:
-            ## current bot is second one to speak
-            prompt += f"Wait for the {self.oppo_role['name']}'s statement"
+        output = cached_call(self.llm, rendered, lambda: self.llm.invoke(messages).content,
+                             stage = "generate", role = self.role['name'])
+        self.memory.add_turn(input, output)
+        return output
 
-        return prompt
\ No newline at end of file
+    def stream(self, input):
+        """
+        Streaming version of predict(), yields the reply chunk by chunk as the tokens arrive.
+        The turn is recorded in memory once the reply is complete
+        """
+        messages = self._render(input)
+        rendered = [(m.type, m.content) for m in messages]
+
+        with trace("generate", self.role['name'], llm_fingerprint(self.llm)[1], self.prompt_tokens[-1]) as span:
+            output = lookup(self.llm, rendered)
+            if output is not None:
+                span.cache_hit = True
+                yield output
+            else:
+                chunks = []
+                tokens = self.prompt_tokens[-1] + COMPLETION_TOKEN_ESTIMATE
+                try:
+                    ## the scheduler slot is held until the reply is complete, a stalled stream times out
+                    for chunk in resilient_stream(lambda: self.llm.stream(messages), tokens):
+                        chunks.append(chunk.content)
+                        yield chunk.content
+                except Exception as exc:
+                    if chunks or not (is_transient_error(exc) or is_rate_limit_error(exc)):
+                        raise
+                    ## the stream failed before its first token: fall back to a regular call with deadline and retries
+                    if is_rate_limit_error(exc):
+                        get_scheduler().report_rate_limit(exc, 0)
+                    span.retries += 1
+                    chunks = [resilient_call(lambda: self.llm.invoke(messages).content, tokens)]
+                    yield chunks[0]
+                output = "".join(chunks)
+                store(self.llm, rendered, output)
+            span.completion_tokens = estimate_tokens(output)
+
+        self.memory.add_turn(input, output)
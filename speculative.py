@@ -0,0 +1,126 @@
+## speculative generation of the likely next session
+## users often reset and regenerate the same scenario at another proficiency level or in another language,
+## which used to be a full cold generation every time.
+## Once a session finishes, its likely variants are generated in the background at batch priority, within a token budget.
+## Every LLM call of a variant goes through the persistent cache (llm_cache.py) with exactly the prompts the app sends,
+## so when the user picks one of the variants its script, translations and summary are all served from cache.
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dual_chat_bot import DualChatbot
+from llm_cache import get_cache
+from scheduler import BATCH, priority_scope
+from instrumentation import TRACER, bind, session_scope
+
+## variants generated concurrently for all sessions of the process
+SPECULATIVE_WORKERS = 2
+## variants warmed after one session at most
+MAX_VARIANTS = 3
+## LLM tokens (prompt + completion, cache hits excluded) one speculative run may spend over all its variants
+TOKEN_BUDGET = 30000
+
+
+def likely_variants(spec, proficiency_levels, languages = ()):
+    """
+    Variants of a session spec the user is likely to ask for next, most likely first:
+    the neighbouring proficiency levels, then the other levels, then the same level in the other languages
+
+    Output:
+    list of specs, copies of `spec` with another proficiency_level or language
+    """
+    current = proficiency_levels.index(spec['proficiency_level']) if spec['proficiency_level'] in proficiency_levels else 0
+    levels = sorted((level for level in proficiency_levels if level != spec['proficiency_level']),
+                    key = lambda level: abs(proficiency_levels.index(level) - current))
+    variants = [dict(spec, proficiency_level = level) for level in levels]
+    variants += [dict(spec, language = language) for language in languages if language != spec['language']]
+    return variants
+
+
+def spent_tokens(session):
+    """
+    Tokens actually sent to the LLM by a session, cache hits cost nothing.
+    Read from the session's running aggregates, so it stays exact however many spans the process records
+    """
+    return TRACER.spent_tokens(session)
+
+
+def generate_variant(engine, spec, should_stop = lambda: False):
+    """
+    Runs one session the way the app does - script, batch translation and learning summary -
+    so all of its LLM calls land in the cache. Stops between exchange rounds once should_stop() is true
+
+    Output:
+    True if the variant was generated completely
+    """
+    ## DualChatbot stores the bots in the role dictionary, so every variant gets its own copy
+    spec = copy.deepcopy(spec)
+    dual_chatbots = DualChatbot(engine, spec.pop('role_dict'), **spec)
+    for _ in dual_chatbots.exchanges(translate = False):
+        if should_stop():
+            return False
+
+    utterances = list(dual_chatbots.transcript)
+    dual_chatbots.translate_batch([u.content for u in utterances])
+    if should_stop():
+        return False
+    dual_chatbots.finish_summary([u.role + ': ' + u.content for u in utterances])
+    return True
+
+
+class SpeculativePrefetcher:
+    """
+    Warms the cache with likely next sessions, one speculative run per owner (e.g. a Streamlit session).
+    Starting a new run for an owner cancels its previous one
+    """
+    def __init__(self, engine, workers = SPECULATIVE_WORKERS, max_variants = MAX_VARIANTS, token_budget = TOKEN_BUDGET):
+        self.engine = engine
+        self.max_variants = max_variants
+        self.token_budget = token_budget
+        ## owner -> cancel event of its current run
+        self._runs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "speculative")
+
+    def start(self, owner, variants):
+        """
+        Starts warming the cache with `variants` in the background, returns a future of the number of completed variants.
+        Returns None when there is no persistent cache to warm
+        """
+        if get_cache() is None:
+            return None
+        cancelled = threading.Event()
+        with self._lock:
+            previous = self._runs.get(owner)
+            if previous is not None:
+                previous.set()
+            self._runs[owner] = cancelled
+        return self._pool.submit(bind(self._run), owner, variants[:self.max_variants], cancelled)
+
+    def cancel(self, owner):
+        """
+        Stops the speculative run of owner after its current exchange round, e.g. when the user starts a new session
+        """
+        with self._lock:
+            cancelled = self._runs.pop(owner, None)
+        if cancelled is not None:
+            cancelled.set()
+
+    def _run(self, owner, variants, cancelled):
+        session = f"speculative-{owner}-{time.time_ns()}"
+        completed = 0
+        ## speculative calls yield to interactive sessions in the shared scheduler
+        with priority_scope(BATCH), session_scope(session):
+            try:
+                for spec in variants:
+                    if cancelled.is_set() or spent_tokens(session) >= self.token_budget:
+                        break
+                    should_stop = lambda: cancelled.is_set() or spent_tokens(session) >= self.token_budget
+                    if generate_variant(self.engine, spec, should_stop):
+                        completed += 1
+            finally:
+                TRACER.drop_session(session)
+                with self._lock:
+                    if self._runs.get(owner) is cancelled:
+                        del self._runs[owner]
+        return completed
@@ -0,0 +1,105 @@
+## incremental learning-points summary
+## instead of one long summary call over the whole script after the last exchange,
+## every completed exchange round is folded into running learning-point notes in the background
+## while later rounds are still being generated. finish() then only needs a short merge call over the notes.
+from concurrent.futures import ThreadPoolExecutor
+from langchain.prompts import PromptTemplate
+from llm_pool import get_chain
+from llm_cache import cached_predict
+from instrumentation import bind
+
+## exchange rounds folded into the notes per background call
+ROUNDS_PER_FOLD = 2
+
+FOLD_PROMPT = PromptTemplate(
+    input_variables = ["src_lang", "proficiency", "notes", "script"],
+    template = """
+        You are keeping running notes on the key learning points of a simulated conversation in {src_lang}
+        for {src_lang} learners with proficiency level {proficiency}.
+        The notes cover the key vocabulary, grammar points and function phrases, written in English
+        with examples from the text in {src_lang}.
+
+        Current notes (empty at the start):
+        {notes}
+
+        Update the notes with the learning points of the following new part of the conversation.
+        Keep every point that is still relevant, avoid duplicates and return only the updated notes.
+
+        New part of the conversation :\n
+        {script}
+        """
+)
+
+MERGE_PROMPT = PromptTemplate(
+    input_variables = ["src_lang", "proficiency", "notes"],
+    template = """
+        The following notes collect the key learning points of a simulated conversation in {src_lang}.
+        Turn them into the final summary for students with proficiency level {proficiency} in {src_lang}:
+        group the key vocabulary, grammar points and function phrases, remove repetitions and keep the
+        examples in {src_lang}. Your summary should be conducted in English.
+
+        The notes are :\n
+        {notes}
+        """
+)
+
+
+class IncrementalSummarizer:
+    """
+    Folds exchange rounds into running learning-point notes in a background worker
+    """
+    def __init__(self, engine, language, proficiency_level, rounds_per_fold = ROUNDS_PER_FOLD):
+        self.engine = engine
+        self.language = language
+        self.proficiency_level = proficiency_level
+        self.rounds_per_fold = rounds_per_fold
+        self.notes = ""
+        self._pending = []
+        self._pending_rounds = 0
+        ## every fold, a failed one means notes are missing rounds
+        self._folds = []
+        ## a single worker keeps the folds of one session in order
+        self._worker = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "summary")
+
+    def add_round(self, lines):
+        """
+        Adds the script lines ("role: text") of a completed exchange round
+        """
+        self._pending.extend(lines)
+        self._pending_rounds += 1
+        if self._pending_rounds >= self.rounds_per_fold:
+            self._submit()
+
+    def _submit(self):
+        if not self._pending:
+            return
+        script, self._pending, self._pending_rounds = self._pending, [], 0
+        self._folds.append(self._worker.submit(bind(self._fold), script))
+
+    def _fold(self, script):
+        chain = get_chain(self.engine, "summary_fold", FOLD_PROMPT)
+        self.notes = cached_predict(chain, "summarize_fold",
+            src_lang = self.language,
+            proficiency = self.proficiency_level,
+            notes = self.notes,
+            script = "\n".join(script)
+        ).strip()
+
+    def finish(self):
+        """
+        Folds the remaining rounds, waits for the background work and merges the notes into the final summary.
+        Raises the error of the first failed fold, the notes would miss its rounds
+        """
+        self._submit()
+        try:
+            for fold in self._folds:
+                fold.result()
+        finally:
+            self._worker.shutdown(wait = False)
+
+        chain = get_chain(self.engine, "summary_merge", MERGE_PROMPT)
+        return cached_predict(chain, "summarize_merge",
+            src_lang = self.language,
+            proficiency = self.proficiency_level,
+            notes = self.notes
+        )
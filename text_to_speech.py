@@ -0,0 +1,209 @@
+## audio subsystem: text-to-speech with pluggable backends
+## utterances are synthesized concurrently in a thread pool and the audio bytes are cached
+## by (backend, text, language code) in memory and on disk, so repeated plays never re-synthesize
+import io
+import math
+import os
+import struct
+import threading
+import wave
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from llm_cache import get_cache, make_key
+from instrumentation import bind, trace, estimate_tokens
+
+TTS_WORKERS = 8
+## number of clips kept in memory, older ones are still served from the disk cache
+MEMORY_CACHE_SIZE = 512
+
+
+class GTTSBackend:
+    """
+    Google Text-to-Speech, produces mp3.
+    Library has a limitation - it can have only one voice
+    """
+    name = "gtts"
+    format = "audio/mp3"
+
+    def synthesize(self, text, lang):
+        from gtts import gTTS
+        sound_file = io.BytesIO()
+        gTTS(text = text, lang = lang).write_to_fp(sound_file)
+        return sound_file.getvalue()
+
+    def duration(self, sound):
+        """
+        Playing time in seconds, gTTS produces constant 32 kbit/s mp3
+        """
+        return len(sound) * 8 / 32000
+
+
+class ToneBackend:
+    """
+    Offline stand-in for a real TTS engine, produces a short wav tone whose length grows with the text.
+    Useful for tests and benchmarks where no network is available
+    """
+    name = "tone"
+    format = "audio/wav"
+
+    def __init__(self, sample_rate = 8000, seconds_per_char = 0.01):
+        self.sample_rate = sample_rate
+        self.seconds_per_char = seconds_per_char
+
+    def synthesize(self, text, lang):
+        num_samples = int(self.sample_rate * self.seconds_per_char * max(len(text), 1))
+        frames = b"".join(
+            struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / self.sample_rate)))
+            for i in range(num_samples)
+        )
+        sound_file = io.BytesIO()
+        with wave.open(sound_file, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(frames)
+        return sound_file.getvalue()
+
+    def duration(self, sound):
+        """
+        Playing time in seconds
+        """
+        with wave.open(io.BytesIO(sound), "rb") as wav:
+            return wav.getnframes() / wav.getframerate()
+
+
+TTS_BACKENDS = {
+    'gtts' : GTTSBackend,
+    'tone' : ToneBackend,
+}
+
+
+def register_backend(name, factory):
+    """
+    Makes a TTS backend available under `name`, factory() must return an object
+    with `name`, `format` and a synthesize(text, lang) -> bytes method,
+    optionally a duration(bytes) -> seconds method for live playback
+    """
+    TTS_BACKENDS[name] = factory
+
+
+class SpeechSynthesizer:
+    """
+    Synthesizes and caches speech for one backend
+    """
+    def __init__(self, backend, workers = TTS_WORKERS, memory_cache_size = MEMORY_CACHE_SIZE):
+        self.backend = backend
+        self.format = backend.format
+        self.memory_cache_size = memory_cache_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "tts")
+
+    def synthesize(self, text, lang):
+        """
+        Returns the audio bytes for text, from memory, from disk or freshly synthesized
+        """
+        key = make_key("tts", self.backend.name, text, lang)
+        with trace("tts", model = self.backend.name, prompt_tokens = estimate_tokens(text)) as span:
+            with self._lock:
+                sound = self._memory.get(key)
+                if sound is not None:
+                    self._memory.move_to_end(key)
+                    span.cache_hit = True
+                    return sound
+
+            cache = get_cache()
+            sound = cache.get(key) if cache is not None else None
+            if sound is None:
+                sound = self.backend.synthesize(text, lang)
+                if cache is not None:
+                    cache.put(key, sound)
+            else:
+                span.cache_hit = True
+
+        with self._lock:
+            self._memory[key] = sound
+            while len(self._memory) > self.memory_cache_size:
+                self._memory.popitem(last = False)
+        return sound
+
+    def submit(self, text, lang):
+        """
+        Starts synthesizing text in the background, returns a future of the audio bytes
+        """
+        return self._pool.submit(bind(self.synthesize), text, lang)
+
+    def synthesize_many(self, texts, lang):
+        """
+        Synthesizes all texts concurrently, returns the audio bytes in the same order
+        """
+        futures = [self.submit(text, lang) for text in texts]
+        return [future.result() for future in futures]
+
+    def duration(self, sound):
+        """
+        Playing time of a clip in seconds, 0 if the backend can't tell
+        """
+        duration = getattr(self.backend, "duration", None)
+        return duration(sound) if duration is not None else 0.0
+
+
+class LiveAudio:
+    """
+    Synthesizes utterances in the background the moment they are generated
+    and hands the clips out for playback in generation order
+    """
+    def __init__(self, synthesizer, lang):
+        self.synthesizer = synthesizer
+        self.lang = lang
+        self._clips = deque()
+        self._lock = threading.Lock()
+
+    def add(self, utterance):
+        """
+        Starts synthesizing an utterance, its audio is also stored on the utterance once ready
+        """
+        future = self.synthesizer.submit(utterance.content, self.lang)
+        def keep(future):
+            if future.exception() is None:
+                utterance.audio = future.result()
+        future.add_done_callback(keep)
+        with self._lock:
+            self._clips.append(future)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clips)
+
+    def next_clip(self, timeout = None):
+        """
+        Waits for the oldest clip that wasn't played yet
+
+        Outputs:
+        ------------
+        (audio bytes, playing time in seconds)
+        """
+        with self._lock:
+            future = self._clips.popleft()
+        sound = future.result(timeout)
+        return sound, self.synthesizer.duration(sound)
+
+
+_synthesizers = {}
+_synthesizers_lock = threading.Lock()
+
+
+def get_synthesizer(backend = None):
+    """
+    Returns the process-wide synthesizer for a backend,
+    the default backend is taken from the TTS_BACKEND environment variable ('gtts' if unset)
+    """
+    name = backend or os.getenv("TTS_BACKEND", "gtts")
+    with _synthesizers_lock:
+        synthesizer = _synthesizers.get(name)
+        if synthesizer is None:
+            if name not in TTS_BACKENDS:
+                raise KeyError("Currently unsupported TTS backend!")
+            synthesizer = SpeechSynthesizer(TTS_BACKENDS[name]())
+            _synthesizers[name] = synthesizer
+    return synthesizer
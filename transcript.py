@@ -0,0 +1,105 @@
+## compact, append-only transcript shared by both chatbots of a DualChatbot
+## every utterance is stored exactly once; each bot reads the conversation through a role-swapped view
+## (its own utterances are AI messages, the other bot's utterances are human messages),
+## so there are no per-bot copies of the history kept in LangChain message objects
+import sys
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+class Utterance:
+    """
+    One message of the conversation.
+    translation and audio stay None until they are first requested
+    """
+    __slots__ = ('speaker', 'role', 'content', 'translation', 'audio')
+
+    def __init__(self, speaker, role, content, translation = None, audio = None):
+        ## speaker is the role key ('role1' / 'role2'), role the displayed role name
+        self.speaker = sys.intern(speaker)
+        self.role = sys.intern(role)
+        self.content = content
+        self.translation = translation
+        self.audio = audio
+
+
+class Transcript:
+    """
+    Append-only list of utterances
+    """
+    __slots__ = ('utterances',)
+
+    def __init__(self):
+        self.utterances = []
+
+    def append(self, speaker, role, content):
+        """
+        Records a new utterance and returns it
+        """
+        utterance = Utterance(speaker, role, content)
+        self.utterances.append(utterance)
+        return utterance
+
+    def __len__(self):
+        return len(self.utterances)
+
+    def __iter__(self):
+        return iter(self.utterances)
+
+    def __getitem__(self, index):
+        return self.utterances[index]
+
+    def by_speaker(self, speaker):
+        """
+        Utterances of one speaker ('role1' / 'role2'), in order
+        """
+        return [u for u in self.utterances if u.speaker == speaker]
+
+    def rounds(self):
+        """
+        Complete exchange rounds as (role1 utterance, role2 utterance) pairs
+        """
+        return list(zip(self.by_speaker('role1'), self.by_speaker('role2')))
+
+    def view(self, speaker, opener = None):
+        """
+        Role-swapped view of the transcript for the bot playing `speaker`
+        """
+        return TranscriptView(self, speaker, opener)
+
+
+class TranscriptView:
+    """
+    Presents the shared transcript as the chat history of one bot.
+    Used as message source by the memory strategies in chat_memory.py
+    """
+    __slots__ = ('transcript', 'speaker', 'opener')
+
+    def __init__(self, transcript, speaker, opener = None):
+        self.transcript = transcript
+        self.speaker = speaker
+        ## opener is the instruction the starting bot receives before anybody spoke
+        self.opener = opener
+
+    def messages(self):
+        """
+        Completed turns of this bot: everything up to and including its own latest utterance
+        """
+        utterances = self.transcript.utterances
+        end = len(utterances)
+        while end > 0 and utterances[end - 1].speaker != self.speaker:
+            end -= 1
+        if end == 0:
+            return []
+
+        messages = [HumanMessage(content = self.opener)] if self.opener else []
+        for u in utterances[:end]:
+            if u.speaker == self.speaker:
+                messages.append(AIMessage(content = u.content))
+            else:
+                messages.append(HumanMessage(content = u.content))
+        return messages
+
+    def add_turn(self, input, output):
+        """
+        Nothing to record, the DualChatbot appends every utterance to the shared transcript
+        """
@@ -0,0 +1,295 @@
+## local vocabulary and grammar index over generated transcripts
+## every utterance is tokenized as it is recorded (subscribe a session's indexer to its DualChatbot) and added to
+## an inverted index word -> sessions -> message positions, with frequency counts and per proficiency level stats.
+## "Which lessons use word X" is a dictionary lookup, and the vocabulary list of a session is computed locally,
+## deterministically and without another LLM call.
+##
+## the index lives in memory, saved lessons (see lesson_store.py) are indexed again with add_lesson()
+import itertools
+import re
+import threading
+from collections import Counter, defaultdict
+
+## words of letters, with inner apostrophes / hyphens ("don't", "porte-monnaie")
+_WORD = re.compile(r"[^\W\d_]+(?:['’\-][^\W\d_]+)*")
+## French elided articles and pronouns are split off their word ("l'eau" -> "eau")
+_ELISION = re.compile(r"^(?:c|d|j|l|m|n|s|t|qu|jusqu|lorsqu|puisqu)['’]")
+
+STOPWORDS = {
+    'English' : set("""a an the and or but if of to in on at for with from by as is are was were be been am i you he she it
+                       we they me him her us them my your his its our their this that these those do does did have has had
+                       not no so than then there here what which who how can will would could should just very""".split()),
+    'German' : set("""der die das den dem des ein eine einen einem einer und oder aber wenn von zu zum zur in im an am auf
+                      für mit aus bei ist sind war waren sein bin bist ich du er sie es wir ihr mich dich mir dir uns euch
+                      mein dein sein nicht kein keine so als dann da hier was wer wie auch noch schon sehr""".split()),
+    'Spanish' : set("""el la los las un una unos unas y o pero si de del a al en con por para es son era eran ser estar
+                       soy eres yo tú él ella nosotros vosotros ellos ellas me te se nos le les mi tu su que qué como
+                       no muy más ya también aquí lo""".split()),
+    'French' : set("""le la les un une des et ou mais si de du à au aux en dans sur pour par avec est sont était être
+                      suis es je tu il elle nous vous ils elles me te se moi toi lui leur mon ton son ma ta sa mes tes
+                      ses ce cette ces que qui quoi comment ne pas plus très aussi ici y""".split()),
+}
+
+## lightweight grammar markers, matched on the lower-cased utterance
+GRAMMAR_PATTERNS = {
+    'English' : {
+        'questions' : r"\?",
+        'modal verbs' : r"\b(?:can|could|would|should|may|might|must)\b",
+        'present progressive' : r"\b(?:am|is|are)\s+\w+ing\b",
+        'going-to future' : r"\bgoing to\s+\w+",
+        'past simple (-ed)' : r"\b\w{3,}ed\b",
+        'polite requests' : r"\b(?:could you|would you|i'd like|i would like)\b",
+    },
+    'German' : {
+        'questions' : r"\?",
+        'modal verbs' : r"\b(?:kann|kannst|können|muss|musst|müssen|will|willst|wollen|darf|dürfen|soll|sollen|möchte|möchten)\b",
+        'perfect tense' : r"\b(?:habe|hast|hat|haben|habt|bin|bist|ist|sind|seid)\b[^.!?]*\bge\w+(?:t|en)\b",
+        'polite requests' : r"\b(?:könnten sie|hätte gern|hätten sie|ich möchte|bitte)\b",
+        'subjunctive (würde)' : r"\bwürde\w*\b",
+    },
+    'Spanish' : {
+        'questions' : r"[¿?]",
+        'present progressive' : r"\b(?:estoy|estás|está|estamos|están)\s+\w+(?:ando|iendo)\b",
+        'near future (ir a)' : r"\b(?:voy|vas|va|vamos|van)\s+a\s+\w+(?:ar|er|ir)\b",
+        'polite requests' : r"\b(?:por favor|quisiera|me gustaría|podría)\b",
+        'preterite' : r"\b\w+(?:é|ó|aron|ieron)\b",
+    },
+    'French' : {
+        'questions' : r"\?",
+        'passé composé' : r"\b(?:ai|as|a|avons|avez|ont|suis|es|est|sommes|êtes|sont)\s+\w+(?:é|i|u)e?s?\b",
+        'near future (aller)' : r"\b(?:vais|vas|va|allons|allez|vont)\s+\w+(?:er|ir|re)\b",
+        'polite requests' : r"\b(?:je voudrais|s'il vous plaît|pourriez-vous|pouvez-vous)\b",
+        'conditional' : r"\b\w+(?:rais|rait|rions|riez|raient)\b",
+    },
+}
+_GRAMMAR = {language: {name: re.compile(pattern) for name, pattern in patterns.items()}
+            for language, patterns in GRAMMAR_PATTERNS.items()}
+
+
+def tokenize(text, language):
+    """
+    Lower-cased word tokens of text, numbers and punctuation are dropped
+    """
+    tokens = []
+    for word in _WORD.findall(text.lower()):
+        if language == 'French':
+            word = _ELISION.sub("", word)
+        tokens.append(word)
+    return tokens
+
+
+def content_words(tokens, language):
+    """
+    Tokens worth learning: no stop words, no single letters
+    """
+    stopwords = STOPWORDS.get(language, ())
+    return [t for t in tokens if len(t) > 1 and t not in stopwords]
+
+
+def grammar_features(text, language):
+    """
+    Names of the grammar markers found in text
+    """
+    lowered = text.lower()
+    return [name for name, pattern in _GRAMMAR.get(language, {}).items() if pattern.search(lowered)]
+
+
+class VocabularyIndex:
+    """
+    Thread-safe inverted index of the vocabulary and grammar markers of many sessions.
+    Words are keyed by (language, word), the same spelling in two languages is two entries
+    """
+    def __init__(self, proficiency_levels = ()):
+        ## levels from easiest to hardest, levels only seen in sessions are appended
+        self.proficiency_levels = list(proficiency_levels)
+        self.sessions = {}
+        ## (language, word) -> session id -> message positions
+        self.postings = defaultdict(lambda: defaultdict(list))
+        ## (language, word) -> occurrences in all sessions
+        self.frequency = Counter()
+        ## (language, word) -> proficiency level -> occurrences
+        self.level_counts = defaultdict(Counter)
+        ## (language, grammar marker) -> session id -> message positions
+        self.grammar = defaultdict(lambda: defaultdict(list))
+        self._lock = threading.Lock()
+
+    def add_session(self, session_id, settings, title = None):
+        """
+        Registers a session with its settings (language, proficiency_level, ...) before its utterances are added
+        """
+        with self._lock:
+            self.sessions[session_id] = {
+                'language' : settings['language'],
+                'proficiency_level' : settings['proficiency_level'],
+                'title' : title or settings.get('scenario', session_id),
+                'words' : Counter(),
+                'grammar' : Counter(),
+                'messages' : 0,
+            }
+            if settings['proficiency_level'] not in self.proficiency_levels:
+                self.proficiency_levels.append(settings['proficiency_level'])
+
+    def add_utterance(self, session_id, position, text):
+        """
+        Indexes the utterance at transcript position `position` of a registered session
+        """
+        with self._lock:
+            ## utterances recorded after the session was removed are dropped
+            session = self.sessions.get(session_id)
+            if session is None:
+                return
+            language, level = session['language'], session['proficiency_level']
+            words = content_words(tokenize(text, language), language)
+            for word in words:
+                key = (language, word)
+                self.postings[key][session_id].append(position)
+                self.frequency[key] += 1
+                self.level_counts[key][level] += 1
+            session['words'].update(words)
+            for feature in grammar_features(text, language):
+                self.grammar[(language, feature)][session_id].append(position)
+                session['grammar'][feature] += 1
+            session['messages'] += 1
+
+    def indexer(self, session_id, settings, title = None):
+        """
+        Registers a session and returns a callback for DualChatbot.subscribe that indexes every recorded utterance
+        """
+        self.add_session(session_id, settings, title)
+        positions = itertools.count()
+
+        def index_utterance(utterance):
+            self.add_utterance(session_id, next(positions), utterance.content)
+        return index_utterance
+
+    def add_lesson(self, session_id, settings, transcript, title = None):
+        """
+        Indexes a complete transcript, e.g. of a saved lesson
+        """
+        index_utterance = self.indexer(session_id, settings, title)
+        for utterance in transcript:
+            index_utterance(utterance)
+
+    def rename(self, session_id, new_id):
+        """
+        Re-keys a session, e.g. once a generated session is saved and known by its path
+        """
+        with self._lock:
+            session = self.sessions.pop(session_id)
+            self.sessions[new_id] = session
+            for word in session['words']:
+                postings = self.postings[(session['language'], word)]
+                postings[new_id] = postings.pop(session_id)
+            for feature in session['grammar']:
+                postings = self.grammar[(session['language'], feature)]
+                postings[new_id] = postings.pop(session_id)
+
+    def remove(self, session_id):
+        """
+        Drops a session and its counts, e.g. a generated session that was reset without being saved
+        """
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return
+            language, level = session['language'], session['proficiency_level']
+            for word, count in session['words'].items():
+                key = (language, word)
+                self.postings[key].pop(session_id, None)
+                if not self.postings[key]:
+                    del self.postings[key]
+                self.frequency[key] -= count
+                self.level_counts[key][level] -= count
+                if self.frequency[key] <= 0:
+                    del self.frequency[key]
+                    del self.level_counts[key]
+                elif self.level_counts[key][level] <= 0:
+                    del self.level_counts[key][level]
+            for feature in session['grammar']:
+                key = (language, feature)
+                self.grammar[key].pop(session_id, None)
+                if not self.grammar[key]:
+                    del self.grammar[key]
+
+    def _normalize(self, word, language):
+        tokens = tokenize(word, language or 'English')
+        return tokens[0] if tokens else word.lower().strip()
+
+    def lessons_with(self, word, language = None, sessions = None):
+        """
+        Sessions using word, most occurrences first, only among the session ids in `sessions` if given
+
+        Outputs:
+        ------------
+        list of (session id, language, message positions)
+        """
+        with self._lock:
+            languages = [language] if language else sorted({s['language'] for s in self.sessions.values()})
+            hits = []
+            for lang in languages:
+                for session_id, positions in self.postings.get((lang, self._normalize(word, lang)), {}).items():
+                    if sessions is not None and session_id not in sessions:
+                        continue
+                    hits.append((session_id, lang, list(positions)))
+        return sorted(hits, key = lambda hit: (-len(hit[2]), str(hit[0])))
+
+    def lessons_with_grammar(self, feature, language):
+        """
+        Sessions using a grammar marker of GRAMMAR_PATTERNS, as (session id, message positions) pairs
+        """
+        with self._lock:
+            return sorted(((session_id, list(positions)) for session_id, positions in self.grammar.get((language, feature), {}).items()),
+                          key = lambda hit: (-len(hit[1]), str(hit[0])))
+
+    def difficulty(self, word, language):
+        """
+        Difficulty stats of a word: occurrences per proficiency level and the easiest level it is used at
+
+        Output:
+        dict with 'counts' (level -> occurrences), 'sessions' and 'level' (None for unknown words)
+        """
+        key = (language, self._normalize(word, language))
+        with self._lock:
+            counts = self.level_counts.get(key, Counter())
+            used = [level for level in self.proficiency_levels if counts[level]]
+            return {
+                'counts' : {level: counts[level] for level in self.proficiency_levels},
+                'sessions' : len(self.postings.get(key, ())),
+                'level' : used[0] if used else None,
+            }
+
+    def session_vocabulary(self, session_id, limit = 15):
+        """
+        Key vocabulary of a session, deterministic: most frequent in the session first,
+        ties go to the words that are rarer across all indexed sessions, then alphabetical
+
+        Outputs:
+        ------------
+        list of (word, occurrences in the session, easiest level the word is used at)
+        """
+        with self._lock:
+            session = self.sessions[session_id]
+            language = session['language']
+            ranked = sorted(session['words'].items(),
+                            key = lambda item: (-item[1], len(self.postings[(language, item[0])]), item[0]))[:limit]
+        return [(word, count, self.difficulty(word, language)['level']) for word, count in ranked]
+
+    def session_grammar(self, session_id):
+        """
+        Grammar markers of a session with their number of messages, most frequent first
+        """
+        with self._lock:
+            return sorted(self.sessions[session_id]['grammar'].items(), key = lambda item: (-item[1], item[0]))
+
+    def vocabulary_markdown(self, session_id, limit = 15):
+        """
+        Markdown section with the key vocabulary and grammar markers of a session, shown next to the LLM summary
+        """
+        lines = ["**Key vocabulary:**", ""]
+        for word, count, level in self.session_vocabulary(session_id, limit):
+            lines.append(f"- {word} ({count}x, {level})")
+        grammar = self.session_grammar(session_id)
+        if grammar:
+            lines += ["", "**Grammar in this lesson:**", ""]
+            lines += [f"- {feature} ({count} messages)" for feature, count in grammar]
+        return "\n".join(lines)